@@ -2,31 +2,95 @@ from flask import (
     Flask, render_template, request, redirect,
     session, Response, send_file, jsonify
 )
-from db import get_db, init_db, close_db
+from db import (
+    get_db, init_db, close_db, requested_days, today,
+    items_for_order, items_by_order, pool as db_pool
+)
 from auth import login_required
+from realtime import (
+    hub, touch, stream as live_stream, ADMIN_TOPICS, KITCHEN_TOPICS
+)
 
-import os, json, time, sqlite3, qrcode
-from zipfile import ZipFile
-from reportlab.pdfgen import canvas
+import os, io, csv, hashlib, hmac, secrets, sqlite3
+from datetime import date
 from flask_dance.contrib.google import make_google_blueprint
 from werkzeug.security import generate_password_hash, check_password_hash
 from menu_templates import MENU_TEMPLATES
+import images
+import qr
+import billing
+import escpos
+import printing
+import workers
+import sentiment
+import keywords
+from ratelimit import RateLimiter
+import menu_import
+import order_writer
+import metrics
+import slow_queries
+import shards
+from shards import get_tenant_db
+from menu_cache import menu_cache, bump_version, etag_for, partition, by_id
+import click
+import stats
 # --------------------------------------------------
 # CONFIG
 # --------------------------------------------------
 
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-app = Flask(__name__)
+class RestaurantApp(Flask):
+    def get_send_file_max_age(self, filename):
+        # Content-hashed uploads never change, so browsers keep them forever
+        if filename and images.is_immutable(filename):
+            return 31536000
+        return super().get_send_file_max_age(filename)
+
+
+app = RestaurantApp(__name__)
 app.secret_key = "saas_qr_restaurant_secret"
 
 init_db()
+if shards.enabled():
+    shards.init_shards()
+app.teardown_appcontext(shards.close_tenant_dbs)
 app.teardown_appcontext(close_db)
+metrics.instrument(app)
+metrics.registry.add_collector(lambda: [
+    ("db_pool_connections", (("state", state),), db_pool.stats()[state])
+    for state in ("idle", "in_use")
+])
 
 UPLOAD_FOLDER = "static/uploads"
-QR_FOLDER = "static/qr"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(QR_FOLDER, exist_ok=True)
+os.makedirs(qr.CACHE_FOLDER, exist_ok=True)
+
+# e.g. https://order.example.com — used in table QR codes
+app.config["PUBLIC_BASE_URL"] = os.environ.get("PUBLIC_BASE_URL")
+
+# Part of the customer page ETag, so a redeployed template is not
+# answered with a 304 for the old one.
+CUSTOMER_TEMPLATE_STAMP = int(os.path.getmtime(
+    os.path.join(app.root_path, "templates", "customer.html")
+))
+
+# Seconds a client is asked to wait after a write lost the SQLite lock
+LOCKED_RETRY_AFTER = 1
+
+
+@app.errorhandler(sqlite3.OperationalError)
+def database_locked(e):
+    # Under gevent a write gives up on the lock after DB_BUSY_TIMEOUT_MS
+    # (see gunicorn.conf.py). Nothing was written, so answer with a JSON
+    # 503 the pages can show and retry rather than an HTML 500. Other
+    # OperationalErrors are real errors.
+    if "is locked" not in str(e):
+        raise e
+    response = jsonify({"error": "We're busy right now, please try again"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(LOCKED_RETRY_AFTER)
+    return response
 
 # --------------------------------------------------
 # GOOGLE AUTH (optional)
@@ -138,6 +202,7 @@ def signup():
             ))
 
             restaurant_id = cursor.lastrowid  # ✅ SAFE
+            stats.restaurant_created(db, restaurant_id)
 
             # ✅ CREATE ADMIN USER
             hashed_pw = generate_password_hash(request.form["password"])
@@ -161,6 +226,9 @@ def signup():
                 error="Something went wrong. Please try again."
             )
 
+        if shards.enabled():
+            shards.ensure_shard(restaurant_id)
+
         # ✅ LOGIN USER
         session.clear()
         session["user"] = email
@@ -181,74 +249,383 @@ def logout():
 # PLATFORM (SUPERADMIN)
 # --------------------------------------------------
 
+PLATFORM_SORTS = {
+    # sort key -> (column, cursor type)
+    "newest": ("t.restaurant_id", int),
+    "orders": ("t.order_count", int),
+    "revenue": ("t.gross_revenue", float),
+}
+
+
 @app.route("/platform/restaurants")
 @login_required("superadmin")
 def platform_restaurants():
-    rows = get_db().execute("""
-        SELECT r.id, r.name, r.subdomain,
-               COUNT(o.id) AS total_orders,
-               IFNULL(SUM(o.total),0) AS total_revenue
-        FROM restaurants r
-        LEFT JOIN orders o ON r.id=o.restaurant_id
-        GROUP BY r.id
-        ORDER BY r.id DESC
-    """).fetchall()
+    # Keyset pagination over the restaurant_totals counters: each page
+    # costs O(page size), whatever the total order volume.
+    sort = request.args.get("sort", "newest")
+    if sort not in PLATFORM_SORTS:
+        sort = "newest"
+    column, cast = PLATFORM_SORTS[sort]
+
+    q = request.args.get("q", "").strip()
+    per_page = min(max(request.args.get("per_page", 50, type=int), 1), 200)
+    after = request.args.get("after", "")
+
+    if after:
+        try:
+            value, last_id = after.rsplit(":", 1)
+            after = (cast(value), int(last_id))
+        except ValueError:
+            return "Invalid cursor", 400
+
+    where, params = [], []
+
+    if q:
+        pattern = "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where.append("(r.name LIKE ? ESCAPE '\\' OR r.subdomain LIKE ? ESCAPE '\\')")
+        params += [pattern, pattern]
+
+    if shards.enabled():
+        rows = sharded_platform_rows(where, params, sort, after, per_page + 1)
+    else:
+        if after:
+            where.append(f"({column}, t.restaurant_id) < (?, ?)")
+            params += after
+
+        rows = get_db().execute(f"""
+            SELECT r.id, r.name, r.subdomain,
+                   t.order_count AS total_orders,
+                   t.gross_revenue AS total_revenue
+            FROM restaurant_totals t
+            JOIN restaurants r ON r.id = t.restaurant_id
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY {column} DESC, t.restaurant_id DESC
+            LIMIT ?
+        """, (*params, per_page + 1)).fetchall()
+
+    restaurants = [dict(r) for r in rows[:per_page]]
+
+    next_cursor = None
+    if len(rows) > per_page:
+        last = restaurants[-1]
+        value = {
+            "newest": last["id"],
+            "orders": last["total_orders"],
+            "revenue": last["total_revenue"],
+        }[sort]
+        next_cursor = f"{value}:{last['id']}"
 
     return render_template(
         "platform_restaurants.html",
-        restaurants=[dict(r) for r in rows]
+        restaurants=restaurants,
+        sort=sort,
+        q=q,
+        per_page=per_page,
+        next_cursor=next_cursor
     )
 
+
+def sharded_platform_rows(where, params, sort, after, limit):
+    # Totals live in each restaurant's shard: read them from every shard
+    # in parallel, then sort and page here. O(restaurants) per page.
+    catalog = get_db().execute(f"""
+        SELECT r.id, r.name, r.subdomain FROM restaurants r
+        {"WHERE " + " AND ".join(where) if where else ""}
+    """, params).fetchall()
+
+    def totals(rid, conn):
+        return conn.execute("""
+            SELECT order_count, gross_revenue FROM restaurant_totals
+            WHERE restaurant_id=?
+        """, (rid,)).fetchone()
+
+    rows = []
+    for r, t in zip(catalog, shards.fan_out(totals, [r["id"] for r in catalog])):
+        rows.append(dict(
+            r,
+            total_orders=t["order_count"] if t else 0,
+            total_revenue=t["gross_revenue"] if t else 0
+        ))
+
+    key = {
+        "newest": lambda r: (r["id"], r["id"]),
+        "orders": lambda r: (r["total_orders"], r["id"]),
+        "revenue": lambda r: (r["total_revenue"], r["id"]),
+    }[sort]
+    if after:
+        rows = [r for r in rows if key(r) < after]
+    rows.sort(key=key, reverse=True)
+    return rows[:limit]
+
+
+@app.route("/platform/db-pool")
+@login_required("superadmin")
+def platform_db_pool():
+    # Counters for the worker process that answered this request
+    return jsonify(dict(db_pool.stats(), pid=os.getpid()))
+
+
+@app.route("/metrics")
+def metrics_page():
+    # Prometheus text format, summed over every worker process
+    if not metrics.ENABLED:
+        return "Metrics are off (set METRICS=1)", 404
+    if not metrics.authorized():
+        return "Forbidden", 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # --------------------------------------------------
 # CUSTOMER
 # --------------------------------------------------
 
 
+def public_restaurant(subdomain):
+    r = get_db().execute(
+        "SELECT id, name, menu_version FROM restaurants WHERE subdomain=?",
+        (subdomain,)
+    ).fetchone()
+    if r and shards.enabled():
+        # menu_version is bumped next to the menu, in the restaurant's shard
+        r = get_tenant_db(r["id"]).execute(
+            "SELECT id, name, menu_version FROM restaurants WHERE id=?",
+            (r["id"],)
+        ).fetchone()
+    return r
+
+
+def cached_response(etag, build, max_age=0):
+    # 304 when the client already holds this version; build() is only
+    # called for a full response.
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = build()
+
+    response.set_etag(etag)
+    if max_age:
+        response.headers["Cache-Control"] = f"public, max-age={max_age}, immutable"
+    else:
+        response.headers["Cache-Control"] = "public, no-cache"
+    return response
+
+
 @app.route("/customer/<restaurant>")
 def customer(restaurant):
-    db = get_db()
-    r = db.execute(
-        "SELECT * FROM restaurants WHERE subdomain=?",
-        (restaurant,)
-    ).fetchone()
+    r = public_restaurant(restaurant)
 
     if not r:
         return "Restaurant not found", 404
 
-    menu = db.execute(
-        "SELECT * FROM menu WHERE restaurant_id=? AND available=1",
-        (r["id"],)
-    ).fetchall()
+    def build():
+        entry = menu_cache.menu(get_tenant_db(r["id"]), r["id"], r["menu_version"])
+        if "html" not in entry:
+            # Only the first category is embedded for a fast first paint;
+            # the page fetches the rest from the public menu API.
+            categories, by_category = partition(entry)
+            first = categories[0]["name"] if categories else None
+            entry["html"] = render_template(
+                "customer.html",
+                menu=[
+                    {f: i[f] for f in MENU_FIELDS}
+                    for i in by_category.get(first, [])
+                ],
+                categories=categories,
+                loaded=[first] if categories else [],
+                menu_version=r["menu_version"],
+                restaurant_name=r["name"],
+                restaurant_id=r["id"]
+            )
+        return Response(entry["html"], mimetype="text/html")
 
-    return render_template(
-        "customer.html",
-        menu=[dict(m) for m in menu],
-        restaurant_name=r["name"],
-        restaurant_id=r["id"],
-        table=request.args.get("table")
-    )
+    # The page only changes with the menu version (the table number is
+    # read from the URL client-side), so repeat scans revalidate to a 304.
+    return cached_response(f"{etag_for(r)}-{CUSTOMER_TEMPLATE_STAMP}", build)
+
+
+# --------------------------------------------------
+# PUBLIC MENU API (no login, cacheable)
+# --------------------------------------------------
+
+MENU_FIELDS = ("id", "name", "price", "category", "image", "image_thumb", "image_medium")
+# Responses for the current ?v= never change, so they can be cached hard
+MENU_IMMUTABLE_MAX_AGE = 86400
+
+
+def versioned_max_age(r):
+    return MENU_IMMUTABLE_MAX_AGE if request.args.get("v", type=int) == r["menu_version"] else 0
+
+
+@app.route("/api/public/<restaurant>/menu")
+def public_menu_categories(restaurant):
+    r = public_restaurant(restaurant)
+    if not r:
+        return jsonify({"error": "Restaurant not found"}), 404
+
+    def build():
+        entry = menu_cache.menu(get_tenant_db(r["id"]), r["id"], r["menu_version"])
+        categories, _ = partition(entry)
+        return jsonify({
+            "restaurant_id": r["id"],
+            "version": r["menu_version"],
+            "categories": categories
+        })
+
+    return cached_response(f"{etag_for(r)}-categories", build, versioned_max_age(r))
+
+
+@app.route("/api/public/<restaurant>/menu/items")
+def public_menu_items(restaurant):
+    # ?category=<name> (omit for every item) &fields=id,name,price
+    r = public_restaurant(restaurant)
+    if not r:
+        return jsonify({"error": "Restaurant not found"}), 404
+
+    category = request.args.get("category")
+    fields = tuple(
+        f for f in request.args.get("fields", "").split(",")
+        if f in MENU_FIELDS
+    ) or MENU_FIELDS
+
+    def build():
+        entry = menu_cache.menu(get_tenant_db(r["id"]), r["id"], r["menu_version"])
+        _, by_category = partition(entry)
+        items = entry["menu"] if category is None else by_category.get(category, [])
+        return jsonify({
+            "version": r["menu_version"],
+            "category": category,
+            "items": [{f: i[f] for f in fields} for i in items]
+        })
+
+    key = hashlib.md5(f"{category}|{','.join(fields)}".encode()).hexdigest()[:16]
+    etag = f"{etag_for(r)}-items-{key}"
+    return cached_response(etag, build, versioned_max_age(r))
+
+
+MAX_ITEM_QTY = 100
+MAX_FEEDBACK_CHARS = 1000
+# Feedback posts per client address per minute (per worker)
+FEEDBACK_RATE_LIMIT = int(os.environ.get("FEEDBACK_RATE_LIMIT", 10))
+feedback_limiter = RateLimiter(FEEDBACK_RATE_LIMIT)
 
 
 @app.route("/order", methods=["POST"])
 def place_order():
-    data = request.get_json()
-    items = data["items"]
+    # Clients send menu ids and quantities. Names and prices come from the
+    # restaurant's cached menu, so a stale or forged price never reaches
+    # the order total or the revenue rollups.
+    data = request.get_json(silent=True) or {}
+    restaurant_id = data.get("restaurant_id")
+    lines = data.get("items")
+
+    if not isinstance(restaurant_id, int) or not isinstance(lines, list) or not lines:
+        return jsonify({"error": "restaurant_id and items required"}), 400
+
+    quantities = {}
+    for line in lines:
+        item_id = line.get("id") if isinstance(line, dict) else None
+        qty = line.get("qty") if isinstance(line, dict) else None
+        if not isinstance(item_id, int) or not isinstance(qty, int) or not 1 <= qty <= MAX_ITEM_QTY:
+            return jsonify({"error": "Each item needs a menu id and a quantity"}), 400
+        quantities[item_id] = quantities.get(item_id, 0) + qty
+
+    try:
+        db = get_tenant_db(restaurant_id)
+    except LookupError:
+        return jsonify({"error": "Restaurant not found"}), 404
+    r = db.execute(
+        "SELECT menu_version FROM restaurants WHERE id=?", (restaurant_id,)
+    ).fetchone()
+    if not r:
+        return jsonify({"error": "Restaurant not found"}), 404
+
+    available = by_id(menu_cache.menu(db, restaurant_id, r["menu_version"]))
+    unavailable = [i for i in quantities if i not in available]
+    if unavailable:
+        return jsonify({
+            "error": "Some items are no longer available",
+            "unavailable": unavailable
+        }), 409
+
+    items = [
+        {"id": i, "name": available[i]["name"], "price": available[i]["price"], "qty": qty}
+        for i, qty in quantities.items()
+    ]
+    # Stored with the order and handed only to whoever placed it; leaving
+    # feedback needs it, so order ids alone cannot be used to post any.
+    token = secrets.token_urlsafe(16)
+
+    if order_writer.GROUP_COMMIT:
+        try:
+            order_id = order_writer.writer.submit(
+                restaurant_id, data.get("table"), items, token
+            )
+        except TimeoutError:
+            # Withdrawn from the queue unwritten, so retrying is safe
+            return jsonify({"error": "Order was not placed, please try again"}), 503
+        return jsonify({"success": True, "order_id": order_id, "feedback_token": token})
 
-    total = sum(i["price"] * i["qty"] for i in items)
+    order_id = order_writer.insert_order(
+        db, restaurant_id, data.get("table"), items, token
+    )
 
-    get_db().execute("""
-        INSERT INTO orders
-        (restaurant_id, table_no, items, total, status, created_at)
-        VALUES (?,?,?,?,?,CURRENT_TIMESTAMP)
-    """, (
-        data["restaurant_id"],
-        data["table"],
-        json.dumps(items),
-        total,
-        "Received"
-    ))
+    db.commit()
+    hub.notify(restaurant_id)
+    return jsonify({"success": True, "order_id": order_id, "feedback_token": token})
+
+
+@app.route("/order/<int:order_id>/feedback", methods=["POST"])
+def order_feedback(order_id):
+    # One rating and/or comment per served order, from whoever placed it
+    # (the token /order returned). Only stored here; the feedback worker
+    # scores it in the background.
+    if not feedback_limiter.allow(request.remote_addr):
+        return jsonify({"error": "Too many requests, try again in a minute"}), 429
+
+    data = request.get_json(silent=True) or {}
+    restaurant_id = data.get("restaurant_id")
+    token = data.get("token")
+    rating = data.get("rating")
+    comment = data.get("comment") or ""
+
+    if not isinstance(restaurant_id, int):
+        return jsonify({"error": "restaurant_id required"}), 400
+    if not isinstance(token, str):
+        return jsonify({"error": "Invalid feedback token"}), 403
+    if rating is not None and (not isinstance(rating, int) or not 1 <= rating <= 5):
+        return jsonify({"error": "Rating must be 1 to 5"}), 400
+    if not isinstance(comment, str) or len(comment) > MAX_FEEDBACK_CHARS:
+        return jsonify({"error": f"Comment must be text up to {MAX_FEEDBACK_CHARS} characters"}), 400
+    comment = comment.strip()
+    if rating is None and not comment:
+        return jsonify({"error": "Rating or comment required"}), 400
+
+    try:
+        db = get_tenant_db(restaurant_id)
+    except LookupError:
+        return jsonify({"error": "Order not found"}), 404
+    order = db.execute(
+        "SELECT status, feedback_token FROM orders WHERE id=? AND restaurant_id=?",
+        (order_id, restaurant_id)
+    ).fetchone()
+    if not order:
+        return jsonify({"error": "Order not found"}), 404
+    # Orders placed before tokens were stored have none and take no feedback
+    if not order["feedback_token"] or not hmac.compare_digest(
+        token.encode(), order["feedback_token"].encode()
+    ):
+        return jsonify({"error": "Invalid feedback token"}), 403
+    if order["status"] != "Served":
+        return jsonify({"error": "Feedback opens once the order is served"}), 409
+
+    try:
+        db.execute("""
+            INSERT INTO feedback (order_id, restaurant_id, rating, comment)
+            VALUES (?, ?, ?, ?)
+        """, (order_id, restaurant_id, rating, comment or None))
+    except sqlite3.IntegrityError:
+        return jsonify({"error": "Feedback already received"}), 409
 
-    get_db().commit()
+    db.commit()
     return jsonify({"success": True})
 # --------------------------------------------------
 # ADMIN & KITCHEN
@@ -262,11 +639,13 @@ def admin():
 @app.route("/api/order/<int:order_id>/add-item", methods=["POST"])
 @login_required("admin")
 def add_item_to_order(order_id):
-    db = get_db()
-    data = request.json
+    db = get_tenant_db(session["restaurant_id"])
+    data = request.get_json(silent=True) or {}
 
-    qty = int(data["qty"])
-    item_id = data["item_id"]
+    qty = data.get("qty")
+    item_id = data.get("item_id")
+    if not isinstance(item_id, int) or not isinstance(qty, int) or not 1 <= qty <= MAX_ITEM_QTY:
+        return jsonify({"error": f"item_id and a quantity from 1 to {MAX_ITEM_QTY} required"}), 400
 
     # Fetch menu item
     item = db.execute("""
@@ -277,27 +656,27 @@ def add_item_to_order(order_id):
 
     # Fetch order
     order = db.execute("""
-        SELECT items, total, table_no
+        SELECT table_no
         FROM orders
         WHERE id=? AND restaurant_id=?
     """, (order_id, session["restaurant_id"])).fetchone()
 
-    items = json.loads(order["items"])
+    if not item or not order:
+        return jsonify({"error": "Item or order not found"}), 404
 
     # Add to main order (for billing)
-    items.append({
-        "name": item["name"],
-        "price": item["price"],
-        "qty": qty
-    })
-
-    new_total = order["total"] + (item["price"] * qty)
+    db.execute("""
+        INSERT INTO order_items
+        (order_id, restaurant_id, menu_id, name, price, qty, created_at)
+        VALUES (?,?,?,?,?,?,CURRENT_TIMESTAMP)
+    """, (order_id, session["restaurant_id"], item_id, item["name"], item["price"], qty))
 
     db.execute("""
         UPDATE orders
-        SET items=?, total=?
+        SET total = total + ?
         WHERE id=?
-    """, (json.dumps(items), new_total, order_id))
+    """, (item["price"] * qty, order_id))
+    stats.items_added(db, order_id, item["price"] * qty)
 
     # 🔥 INSERT INTO order_additions (FOR KITCHEN)
     db.execute("""
@@ -312,9 +691,10 @@ def add_item_to_order(order_id):
     qty,
     item["price"]
 ))
-
+    touch(db, session["restaurant_id"])
 
     db.commit()
+    hub.notify(session["restaurant_id"])
     return jsonify({"success": True})
 
 # -----------------------
@@ -330,7 +710,7 @@ def kitchen():
 @app.route("/api/kitchen/additions")
 @login_required("kitchen")
 def kitchen_additions():
-    rows = get_db().execute("""
+    rows = get_tenant_db(session["restaurant_id"]).execute("""
         SELECT * FROM order_additions
         WHERE restaurant_id=? AND status='New'
         ORDER BY created_at ASC
@@ -342,13 +722,16 @@ def kitchen_additions():
 @app.route("/api/kitchen/addition/<int:id>/status", methods=["POST"])
 @login_required("kitchen")
 def update_addition_status(id):
-    get_db().execute("""
+    db = get_tenant_db(session["restaurant_id"])
+    db.execute("""
         UPDATE order_additions
         SET status='Preparing'
         WHERE id=? AND restaurant_id=?
     """, (id, session["restaurant_id"]))
+    touch(db, session["restaurant_id"])
 
-    get_db().commit()
+    db.commit()
+    hub.notify(session["restaurant_id"])
     return jsonify({"success": True})
 
 
@@ -358,26 +741,38 @@ def update_addition_status(id):
 def admin_profile():
     db = get_db()
     rid = session["restaurant_id"]
+    tenant = get_tenant_db(rid)
 
     if request.method == "POST":
-        db.execute("""
-    UPDATE restaurants
-    SET name = ?, gstin = ?, address = ?, phone = ?
-    WHERE id = ?
-""", (
-    request.form["name"],
-    request.form["gstin"],
-    request.form["address"],
-    request.form["phone"],
-    rid
-))
+        printer_url = request.form.get("printer_url", "").strip() or None
+        if printer_url and not printing.valid_target(printer_url):
+            return "Printer must be tcp://host:port on the local network (PRINTER_NETWORKS, PRINTER_PORTS) or file:///path in the spool dir", 400
+
+        values = (
+            request.form["name"],
+            request.form["gstin"],
+            request.form["address"],
+            request.form["phone"],
+            printer_url,
+            rid
+        )
+        # The catalog row serves login and routing; with sharding on, the
+        # shard's copy is what bills, receipts and the menu read.
+        for conn in {db, tenant}:
+            conn.execute("""
+                UPDATE restaurants
+                SET name = ?, gstin = ?, address = ?, phone = ?, printer_url = ?
+                WHERE id = ?
+            """, values)
+        bump_version(tenant, rid)
 
         db.commit()
+        tenant.commit()
 
         return redirect("/admin/profile")
 
     restaurant = db.execute("""
-    SELECT name, gstin, address, phone
+    SELECT name, gstin, address, phone, printer_url
     FROM restaurants
     WHERE id=?
 """, (rid,)).fetchone()
@@ -391,37 +786,133 @@ def admin_profile():
 @app.route("/admin/orders/by-date")
 @login_required("admin")
 def orders_by_date():
-    date = request.args.get("date")  # YYYY-MM-DD
+    # ?date=YYYY-MM-DD for one day, or ?from=YYYY-MM-DD&to=YYYY-MM-DD
+    # (both inclusive) for a history range
     rid = session["restaurant_id"]
 
-    if not date:
-        return jsonify({"error": "Date required"}), 400
+    try:
+        first, last, start, end = requested_days(request.args, request.args.get("date"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    db = get_db()
+    db = get_tenant_db(rid)
 
     orders = db.execute("""
         SELECT *
         FROM orders
         WHERE restaurant_id=?
-        AND DATE(created_at)=?
-        ORDER BY id DESC
-    """, (rid, date)).fetchall()
+        AND created_at >= ? AND created_at < ?
+        ORDER BY created_at DESC, id DESC
+    """, (rid, start, end)).fetchall()
 
-    revenue = db.execute("""
-        SELECT IFNULL(SUM(total),0)
-        FROM orders
-        WHERE restaurant_id=?
-        AND status='Served'
-        AND DATE(created_at)=?
-    """, (rid, date)).fetchone()[0]
+    revenue = stats.served_revenue(db, rid, first, last)
+
+    lines = items_by_order(db, rid, start, end)
+    orders = [dict(o) for o in orders]
+    for o in orders:
+        o["items"] = lines.get(o["id"], [])
 
     return jsonify({
-        "orders": [dict(o) for o in orders],
+        "from": first,
+        "to": last,
+        "orders": orders,
         "revenue": revenue,
         "count": len(orders)
     })
 
 
+@app.route("/admin/analytics/items")
+@login_required("admin")
+def item_analytics():
+    # Best sellers and per-item revenue for ?from=&to= (default: today)
+    limit = request.args.get("limit", 20, type=int)
+
+    try:
+        first, last, start, end = requested_days(request.args, today())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = get_tenant_db(session["restaurant_id"]).execute("""
+        SELECT name,
+               SUM(qty) AS qty,
+               SUM(qty * price) AS revenue
+        FROM order_items
+        WHERE restaurant_id=?
+        AND created_at >= ? AND created_at < ?
+        GROUP BY name
+        ORDER BY qty DESC, revenue DESC
+        LIMIT ?
+    """, (session["restaurant_id"], start, end, limit)).fetchall()
+
+    return jsonify({
+        "from": first,
+        "to": last,
+        "items": [dict(r) for r in rows]
+    })
+
+
+@app.route("/admin/feedback")
+@login_required("admin")
+def feedback_report():
+    # Feedback for ?from=&to= (default: today) with the scores stored by
+    # the feedback worker; comments not scored yet have sentiment null.
+    rid = session["restaurant_id"]
+
+    try:
+        first, last, start, end = requested_days(request.args, today())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    db = get_tenant_db(rid)
+
+    rows = db.execute("""
+        SELECT id, order_id, rating, comment, sentiment, sentiment_label, created_at
+        FROM feedback
+        WHERE restaurant_id=?
+        AND created_at >= ? AND created_at < ?
+        ORDER BY created_at DESC, id DESC
+    """, (rid, start, end)).fetchall()
+
+    summary = db.execute("""
+        SELECT COUNT(*) AS count,
+               AVG(rating) AS avg_rating,
+               AVG(sentiment) AS avg_sentiment,
+               SUM(sentiment_label='positive') AS positive,
+               SUM(sentiment_label='neutral') AS neutral,
+               SUM(sentiment_label='negative') AS negative,
+               SUM(comment IS NOT NULL AND sentiment IS NULL) AS pending
+        FROM feedback
+        WHERE restaurant_id=?
+        AND created_at >= ? AND created_at < ?
+    """, (rid, start, end)).fetchone()
+
+    return jsonify({
+        "from": first,
+        "to": last,
+        "summary": dict(summary),
+        "feedback": [dict(r) for r in rows]
+    })
+
+
+@app.route("/admin/feedback/keywords")
+@login_required("admin")
+def feedback_keywords():
+    # Top keywords for ?period=today|7d|30d|all and the complaints on the
+    # rise. Read from keyword_cache, which only the feedback worker writes;
+    # until it has caught up (say, just after midnight) they are computed
+    # here from the day counts without being stored.
+    period = request.args.get("period", "7d")
+    if period not in keywords.PERIODS:
+        return jsonify({"error": f"period must be one of {', '.join(keywords.PERIODS)}"}), 400
+
+    rid = session["restaurant_id"]
+    db = get_tenant_db(rid)
+    return jsonify({
+        "keywords": keywords.keywords(db, rid, period),
+        "trending": keywords.trending(db, rid),
+    })
+
+
 # ================= KITCHEN USERS (ADMIN) =================
 
 @app.route("/admin/kitchen-users")
@@ -504,7 +995,7 @@ def menu_page():
 @app.route("/api/menu")
 @login_required("admin")
 def api_get_menu():
-    rows = get_db().execute("""
+    rows = get_tenant_db(session["restaurant_id"]).execute("""
         SELECT * FROM menu
         WHERE restaurant_id=?
         ORDER BY id DESC
@@ -520,46 +1011,55 @@ def api_add_menu():
     if not image:
         return jsonify({"error": "Image required"}), 400
 
-    filename = f"{int(time.time())}_{image.filename}"
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    image.save(path)
+    db = get_tenant_db(session["restaurant_id"])
+    # Resized variants are rendered by `flask process-images`; until then
+    # the menu falls back to the original.
+    path = images.store_upload(db, image)
+    thumb, medium = images.variants_for(db, path)
 
-    get_db().execute("""
+    db.execute("""
         INSERT INTO menu
-        (restaurant_id, name, price, category, image, available)
-        VALUES (?,?,?,?,?,1)
+        (restaurant_id, name, price, category, image, image_thumb, image_medium, available)
+        VALUES (?,?,?,?,?,?,?,1)
     """, (
         session["restaurant_id"],
         request.form["name"],
         request.form["price"],
         request.form["category"],
-        path
+        path,
+        thumb,
+        medium
     ))
+    bump_version(db, session["restaurant_id"])
 
-    get_db().commit()
+    db.commit()
     return jsonify({"success": True})
 
 
 @app.route("/api/menu/toggle/<int:item_id>", methods=["POST"])
 @login_required("admin")
 def toggle_menu(item_id):
-    get_db().execute("""
+    db = get_tenant_db(session["restaurant_id"])
+    db.execute("""
         UPDATE menu
         SET available = CASE available WHEN 1 THEN 0 ELSE 1 END
         WHERE id=? AND restaurant_id=?
     """, (item_id, session["restaurant_id"]))
-    get_db().commit()
+    bump_version(db, session["restaurant_id"])
+    db.commit()
     return jsonify({"success": True})
 
 
 @app.route("/api/menu/<int:item_id>", methods=["DELETE"])
 @login_required("admin")
 def delete_menu(item_id):
-    get_db().execute(
+    db = get_tenant_db(session["restaurant_id"])
+    db.execute(
         "DELETE FROM menu WHERE id=? AND restaurant_id=?",
         (item_id, session["restaurant_id"])
     )
-    get_db().commit()
+    bump_version(db, session["restaurant_id"])
+    db.commit()
     return jsonify({"success": True})
 
 @app.route("/api/menu/import", methods=["POST"])
@@ -571,27 +1071,95 @@ def import_menu_template():
     if template not in MENU_TEMPLATES:
         return jsonify({"error": "Invalid template"}), 400
 
-    db = get_db()
     restaurant_id = session["restaurant_id"]
+    db = get_tenant_db(restaurant_id)
 
-    for name, category in MENU_TEMPLATES[template]:
-        db.execute("""
-            INSERT INTO menu (restaurant_id, name, price, category, image, available)
-            VALUES (?, ?, ?, ?, ?, 1)
-        """, (
-            restaurant_id,
-            name,
-            0,
-            category,
-            ""   # no image initially
-        ))
+    # No image and price 0 until the owner fills them in; dishes the menu
+    # already has are left alone, so importing twice adds nothing.
+    menu_import.upsert(db, restaurant_id, [
+        {"name": name, "price": 0, "category": category, "available": 1, "image": ""}
+        for name, category in MENU_TEMPLATES[template]
+    ], update_existing=False)
+    bump_version(db, restaurant_id)
 
     db.commit()
     return jsonify({"success": True})
+
+
+@app.route("/api/menu/bulk", methods=["POST"])
+@login_required("admin")
+def bulk_import_menu():
+    # CSV (upload or text/csv body) or JSON with name, price, category,
+    # available and image (URL). Rows are matched to the menu by name;
+    # valid rows are applied in one transaction, invalid ones reported.
+    # ?dry_run=1 only validates.
+    try:
+        items, errors = menu_import.validate(menu_import.rows_from_request(request))
+    except (ValueError, csv.Error) as e:
+        return jsonify({"error": f"Could not read file: {e}"}), 400
+
+    result = {"inserted": 0, "updated": 0}
+    if items and not request.args.get("dry_run"):
+        restaurant_id = session["restaurant_id"]
+        db = get_tenant_db(restaurant_id)
+        result = menu_import.upsert(db, restaurant_id, items)
+        bump_version(db, restaurant_id)
+        db.commit()
+
+    return jsonify({
+        "success": not errors,
+        "valid": len(items),
+        **result,
+        "errors": errors
+    })
+
+
+@app.route("/api/menu/clone", methods=["POST"])
+@login_required("superadmin")
+def clone_menu():
+    # {"source": <restaurant id>, "targets": [<restaurant id>, ...]}
+    data = request.json or {}
+    source = data.get("source")
+    targets = data.get("targets") or []
+
+    if not isinstance(targets, list) or not all(isinstance(t, int) for t in targets):
+        return jsonify({"error": "targets must be a list of restaurant ids"}), 400
+
+    targets = [t for t in dict.fromkeys(targets) if t != source]
+    if not targets:
+        return jsonify({"error": "No target restaurants"}), 400
+
+    marks = ",".join("?" * len(targets))
+    found = {r[0] for r in get_db().execute(
+        f"SELECT id FROM restaurants WHERE id IN ({marks})", targets
+    )}
+    missing = [t for t in targets if t not in found]
+    if missing:
+        return jsonify({"error": f"Unknown restaurants: {missing}"}), 404
+
+    try:
+        items = menu_import.source_items(get_tenant_db(source), source)
+    except (LookupError, TypeError, ValueError):
+        items = []
+    if not items:
+        return jsonify({"error": "Source restaurant has no menu"}), 404
+
+    # One transaction per target database: with sharding on, a failure
+    # part way leaves the earlier targets cloned.
+    results = {}
+    for rid in targets:
+        db = get_tenant_db(rid)
+        results[rid] = menu_import.upsert(db, rid, items)
+        bump_version(db, rid)
+        db.commit()
+
+    return jsonify({"success": True, "items": len(items), "restaurants": results})
+
+
 @app.route("/api/menu/<int:item_id>", methods=["PUT"])
 @login_required("admin")
 def update_menu_item(item_id):
-    db = get_db()
+    db = get_tenant_db(session["restaurant_id"])
 
     name = request.form.get("name")
     price = request.form.get("price")
@@ -599,21 +1167,21 @@ def update_menu_item(item_id):
     image = request.files.get("image")
 
     if image:
-        filename = f"{int(time.time())}_{image.filename}"
-        path = os.path.join(UPLOAD_FOLDER, filename)
-        image.save(path)
+        path = images.store_upload(db, image)
+        thumb, medium = images.variants_for(db, path)
 
         db.execute("""
             UPDATE menu
-            SET name=?, price=?, category=?, image=?
+            SET name=?, price=?, category=?, image=?, image_thumb=?, image_medium=?
             WHERE id=? AND restaurant_id=?
-        """, (name, price, category, path, item_id, session["restaurant_id"]))
+        """, (name, price, category, path, thumb, medium, item_id, session["restaurant_id"]))
     else:
         db.execute("""
             UPDATE menu
             SET name=?, price=?, category=?
             WHERE id=? AND restaurant_id=?
         """, (name, price, category, item_id, session["restaurant_id"]))
+    bump_version(db, session["restaurant_id"])
 
     db.commit()
     return jsonify({"success": True})
@@ -631,12 +1199,12 @@ def update_order_status(order_id):
     if status not in ["Preparing", "Ready", "Served"]:
         return jsonify({"error": "Invalid status"}), 400
 
-    get_db().execute("""
-        UPDATE orders SET status=?
-        WHERE id=? AND restaurant_id=?
-    """, (status, order_id, session["restaurant_id"]))
+    db = get_tenant_db(session["restaurant_id"])
+    stats.set_status(db, order_id, session["restaurant_id"], status)
+    touch(db, session["restaurant_id"])
 
-    get_db().commit()
+    db.commit()
+    hub.notify(session["restaurant_id"])
     return jsonify({"success": True})
 
 # --------------------------------------------------
@@ -649,48 +1217,72 @@ def admin_qr():
     return render_template("qr_auto.html")
 
 
+MAX_TABLES = 1000
+
+
+def public_base_url():
+    # Where diners' phones reach this app; the request host is only right
+    # when admins use the public address themselves.
+    return app.config["PUBLIC_BASE_URL"] or request.host_url
+
+
 @app.route("/generate_qr/<int:table_no>")
 @login_required("admin")
 def generate_single_qr(table_no):
+    if not 1 <= table_no <= MAX_TABLES:
+        return jsonify({"error": f"Table number must be 1-{MAX_TABLES}"}), 400
+
     r = get_db().execute(
         "SELECT subdomain FROM restaurants WHERE id=?",
         (session["restaurant_id"],)
     ).fetchone()
 
-    qr_dir = f"{QR_FOLDER}/{r['subdomain']}"
-    os.makedirs(qr_dir, exist_ok=True)
-
-    qr_path = f"{qr_dir}/table_{table_no}.png"
-    url = f"http://127.0.0.1:5000/customer/{r['subdomain']}?table={table_no}"
+    url = qr.customer_url(public_base_url(), r["subdomain"], table_no)
+    qr.render_many([url])
 
-    qrcode.make(url).save(qr_path)
-
-    return jsonify({"success": True, "qr": f"/{qr_path}"})
+    return jsonify({"success": True, "qr": f"/{qr.cache_path(url)}"})
 
 
 @app.route("/admin/qr/auto", methods=["POST"])
 @login_required("admin")
 def auto_generate_qr():
-    count = int(request.form["table_count"])
+    count = request.form.get("table_count", type=int)
+
+    if not count or not 1 <= count <= MAX_TABLES:
+        return jsonify({"error": f"Table count must be 1-{MAX_TABLES}"}), 400
 
     r = get_db().execute(
         "SELECT subdomain FROM restaurants WHERE id=?",
         (session["restaurant_id"],)
     ).fetchone()
 
-    qr_dir = f"{QR_FOLDER}/{r['subdomain']}"
-    os.makedirs(qr_dir, exist_ok=True)
+    return send_file(
+        qr.table_zip(public_base_url(), r["subdomain"], count),
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name=f"{r['subdomain']}_table_qrs.zip"
+    )
 
-    zip_path = f"{qr_dir}/table_qrs.zip"
 
-    with ZipFile(zip_path, "w") as zipf:
-        for t in range(1, count + 1):
-            url = f"http://127.0.0.1:5000/customer/{r['subdomain']}?table={t}"
-            img = f"{qr_dir}/table_{t}.png"
-            qrcode.make(url).save(img)
-            zipf.write(img, os.path.basename(img))
+@app.route("/admin/qr/sheet", methods=["POST"])
+@login_required("admin")
+def qr_sheet():
+    count = request.form.get("table_count", type=int)
 
-    return jsonify({"success": True, "zip": f"/{zip_path}"})
+    if not count or not 1 <= count <= MAX_TABLES:
+        return jsonify({"error": f"Table count must be 1-{MAX_TABLES}"}), 400
+
+    r = get_db().execute(
+        "SELECT name, subdomain FROM restaurants WHERE id=?",
+        (session["restaurant_id"],)
+    ).fetchone()
+
+    return send_file(
+        qr.table_sheet(public_base_url(), r["subdomain"], r["name"], count),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"{r['subdomain']}_table_qrs.pdf"
+    )
 
 # --------------------------------------------------
 # BILLING
@@ -699,7 +1291,7 @@ def auto_generate_qr():
 @app.route("/bill/<int:order_id>")
 @login_required("admin")
 def bill(order_id):
-    db = get_db()
+    db = get_tenant_db(session["restaurant_id"])
 
     order = db.execute("""
     SELECT 
@@ -717,30 +1309,19 @@ def bill(order_id):
     if not order:
         return "Order not found", 404
 
-    items = json.loads(order["items"])
+    items = items_for_order(db, order_id)
     subtotal = sum(i["price"] * i["qty"] for i in items)
     gst = round(subtotal * 0.05, 2)
     total = round(subtotal + gst, 2)
 
     # PDF download
     if request.args.get("pdf"):
-        filename = f"bill_{order_id}.pdf"
-        c = canvas.Canvas(filename)
-        c.drawString(100, 780, order["restaurant_name"])
-        c.drawString(100, 760, f"Table: {order['table_no']}")
-
-        y = 720
-        for i in items:
-            c.drawString(
-                100, y,
-                f"{i['name']} x {i['qty']} = ₹{i['price'] * i['qty']}"
-            )
-            y -= 20
-
-        c.drawString(100, y - 20, f"Total: ₹{total}")
-        c.save()
-
-        return send_file(filename, as_attachment=True)
+        return send_file(
+            io.BytesIO(billing.pdf(billing.make_bill(order, items))),
+            mimetype="application/pdf",
+            as_attachment=True,
+            download_name=f"bill_{order_id}.pdf"
+        )
 
     return render_template(
     "bill.html",
@@ -755,10 +1336,48 @@ def bill(order_id):
     phone=order["restaurant_phone"]
 )
 
+@app.route("/admin/bills/export")
+@login_required("admin")
+def export_bills():
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive), &format=pdf for one
+    # document or &format=zip for one file per bill
+    fmt = request.args.get("format", "pdf")
+    rid = session["restaurant_id"]
+
+    try:
+        first, last, start, end = requested_days(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if fmt not in ("pdf", "zip"):
+        return jsonify({"error": "Format must be pdf or zip"}), 400
+
+    if (date.fromisoformat(end) - date.fromisoformat(start)).days > billing.MAX_EXPORT_DAYS:
+        return jsonify({"error": f"Range must be at most {billing.MAX_EXPORT_DAYS} days"}), 400
+
+    bills = billing.load_bills(get_tenant_db(rid), rid, start, end)
+    if not bills:
+        return jsonify({"error": "No orders in range"}), 404
+
+    if fmt == "zip":
+        return send_file(
+            billing.bills_zip(bills),
+            mimetype="application/zip",
+            as_attachment=True,
+            download_name=f"bills_{first}_{last}.zip"
+        )
+
+    return send_file(
+        billing.combined_pdf(bills),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"bills_{first}_{last}.pdf"
+    )
+
 @app.route("/bill/<int:order_id>/thermal")
 @login_required("admin")
 def thermal_bill(order_id):
-    db = get_db()
+    db = get_tenant_db(session["restaurant_id"])
 
     order = db.execute("""
         SELECT o.*, r.name, r.gstin, r.address, r.phone
@@ -770,89 +1389,180 @@ def thermal_bill(order_id):
     if not order:
         return "Order not found", 404
 
-    items = json.loads(order["items"])
-
-    subtotal = sum(i["price"] * i["qty"] for i in items)
-    cgst = round(subtotal * 0.025, 2)
-    sgst = round(subtotal * 0.025, 2)
-    total = round(subtotal + cgst + sgst, 2)
+    items = items_for_order(db, order_id)
+    receipt = escpos.receipt(order, items)
 
     return render_template(
         "bill_thermal.html",
         order=order,
         items=items,
-        subtotal=subtotal,
-        cgst=cgst,
-        sgst=sgst,
-        total=total
+        subtotal=receipt["subtotal"],
+        cgst=receipt["cgst"],
+        sgst=receipt["sgst"],
+        total=receipt["total"]
     )
 
 
+def queue_receipts(order_ids):
+    # Renders the bills straight to ESC/POS and hands them to the print
+    # worker; the browser print dialog is no longer involved.
+    rid = session["restaurant_id"]
+    db = get_tenant_db(rid)
+
+    target = db.execute(
+        "SELECT printer_url FROM restaurants WHERE id=?", (rid,)
+    ).fetchone()["printer_url"]
+    if not target:
+        return jsonify({"error": "No receipt printer configured"}), 400
+
+    receipts = printing.load_receipts(db, rid, order_ids)
+    if not receipts:
+        return jsonify({"error": "Order not found"}), 404
+
+    printing.enqueue(db, rid, target, receipts)
+    db.commit()
+
+    return jsonify({"success": True, "queued": sorted(receipts)})
+
+
+@app.route("/bill/<int:order_id>/print", methods=["POST"])
+@login_required("admin")
+def print_bill(order_id):
+    return queue_receipts([order_id])
+
+
+@app.route("/admin/bills/print", methods=["POST"])
+@login_required("admin")
+def print_bills():
+    order_ids = (request.json or {}).get("order_ids") or []
+
+    if not isinstance(order_ids, list) or not all(isinstance(i, int) for i in order_ids):
+        return jsonify({"error": "order_ids must be a list of ids"}), 400
+
+    if not 1 <= len(order_ids) <= printing.MAX_BATCH:
+        return jsonify({"error": f"Send 1-{printing.MAX_BATCH} order ids"}), 400
+
+    return queue_receipts(order_ids)
+
+
 # --------------------------------------------------
 # SSE (ORDERS + REVENUE)
 # --------------------------------------------------
 
+def sse_response(topics):
+    # Browsers resend the id of the last event they saw when reconnecting
+    last_event_id = request.headers.get("Last-Event-ID", type=int)
+
+    return Response(
+        live_stream(session["restaurant_id"], last_event_id, topics),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.route("/events")
 @login_required(["admin", "kitchen"])
 def events():
-    rid = session["restaurant_id"]
+    # One multiplexed stream per screen: the kitchen also gets its
+    # item additions here instead of polling /api/kitchen/additions.
+    if session["role"] == "kitchen":
+        return sse_response(KITCHEN_TOPICS)
+    return sse_response(ADMIN_TOPICS)
 
-    def stream():
-        while True:
-            conn = sqlite3.connect("restaurant.db")
-            conn.row_factory = sqlite3.Row
+@app.route("/events/additions")
+@login_required("kitchen")
+def addition_events():
+    return sse_response(("addition",))
 
-            orders = conn.execute("""
-                SELECT *
-                FROM orders
-                WHERE restaurant_id=?
-                AND DATE(created_at)=DATE('now')
-                ORDER BY id DESC
-            """, (rid,)).fetchall()
+# --------------------------------------------------
+# CLI
+# --------------------------------------------------
 
-            revenue = conn.execute("""
-                SELECT IFNULL(SUM(total),0)
-                FROM orders
-                WHERE restaurant_id=?
-                AND status='Served'
-                AND DATE(created_at)=DATE('now')
-            """, (rid,)).fetchone()[0]
+@app.cli.command("rebuild-stats")
+@click.option("--check", "check_only", is_flag=True,
+              help="Only compare daily_stats with the raw orders.")
+def rebuild_stats_command(check_only):
+    # flask --app app rebuild-stats [--check]
+    dbs = shards.all_tenant_dbs()
+    mismatches = [m for db in dbs for m in stats.check(db)]
 
-            conn.close()
+    for (rid, day), expected, stored in mismatches:
+        click.echo(f"restaurant {rid} {day}: orders say {expected}, rollup has {stored}")
 
-            yield f"data:{json.dumps({
-                'orders': [dict(o) for o in orders],
-                'today_revenue': revenue
-            })}\n\n"
+    if check_only:
+        click.echo(f"{len(mismatches)} mismatched day(s)")
+        raise SystemExit(1 if mismatches else 0)
 
-            time.sleep(2)
+    for db in dbs:
+        stats.rebuild(db)
+        db.commit()
+    click.echo(f"daily_stats rebuilt ({len(mismatches)} day(s) were off)")
 
-    return Response(stream(), mimetype="text/event-stream")
 
-@app.route("/events/additions")
-@login_required("kitchen")
-def addition_events():
-    rid = session["restaurant_id"]
+@app.cli.command("process-images")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+@click.option("--backfill", is_flag=True,
+              help="First move legacy uploads to content-hash names.")
+def process_images_command(once, backfill):
+    # flask --app app process-images [--once] [--backfill]
+    if backfill:
+        moved = images.backfill(shards.all_tenant_dbs(), shards.all_menu_dbs())
+        click.echo(f"{moved} legacy upload(s) queued")
 
-    def stream():
-        while True:
-            conn = sqlite3.connect("restaurant.db")
-            conn.row_factory = sqlite3.Row
+    workers.run_worker(images.process_pending, shards.all_tenant_dbs, once=once)
 
-            additions = conn.execute("""
-                SELECT *
-                FROM order_additions
-                WHERE restaurant_id=?
-                AND status='New'
-                ORDER BY created_at ASC
-            """, (rid,)).fetchall()
 
-            conn.close()
+@app.cli.command("print-worker")
+@click.option("--once", is_flag=True, help="Exit when the queue is empty.")
+def print_worker_command(once):
+    # flask --app app print-worker [--once]
+    workers.run_worker(printing.process_pending, shards.all_tenant_dbs, once=once)
 
-            yield f"data:{json.dumps([dict(a) for a in additions])}\n\n"
-            time.sleep(2)
 
-    return Response(stream(), mimetype="text/event-stream")
+@app.cli.command("feedback-worker")
+@click.option("--once", is_flag=True, help="Exit when every comment is scored.")
+def feedback_worker_command(once):
+    # flask --app app feedback-worker [--once]
+    workers.run_worker(sentiment.process_pending, shards.all_tenant_dbs, once=once)
+
+
+@app.cli.command("rebuild-keywords")
+def rebuild_keywords_command():
+    # flask --app app rebuild-keywords
+    # Recounts feedback keywords from the comments already scored.
+    count = 0
+    for db in shards.all_tenant_dbs():
+        restaurants = keywords.rebuild(db)
+        keywords.refresh(db, restaurants)
+        db.commit()
+        count += len(restaurants)
+    click.echo(f"keywords rebuilt for {count} restaurant(s)")
+
+
+@app.cli.command("slow-queries")
+@click.option("--log", "log_path", default=slow_queries.LOG_PATH, show_default=True)
+@click.option("--top", default=20, show_default=True, help="Statements to show.")
+@click.option("--large-rows", default=slow_queries.LARGE_TABLE_ROWS, show_default=True,
+              help="Only flag scans of tables bigger than this.")
+def slow_queries_command(log_path, top, large_rows):
+    # flask --app app slow-queries  (after running with SLOW_QUERY_MS set)
+    if not os.path.exists(log_path):
+        raise click.UsageError(f"No log at {log_path}; run with SLOW_QUERY_MS set first.")
+    groups = slow_queries.load(log_path)
+    click.echo(f"{len(groups)} statement(s) over the threshold, slowest total first\n")
+    slow_queries.report(groups, top, large_rows, echo=click.echo)
+
+
+@app.cli.command("shard-tenants")
+@click.option("--purge", is_flag=True,
+              help="Then delete the copied rows from the central database.")
+def shard_tenants_command(purge):
+    # TENANT_SHARD_DIR=shards flask --app app shard-tenants [--purge]
+    # Stop the web workers first.
+    if not shards.enabled():
+        raise click.UsageError("Set TENANT_SHARD_DIR first.")
+    count = shards.migrate(purge=purge, echo=click.echo)
+    click.echo(f"{count} restaurant(s) in {shards.SHARD_DIR}")
 
 # --------------------------------------------------
 # ROOT
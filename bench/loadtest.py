@@ -0,0 +1,370 @@
+"""
+Drives the ordering hot paths with a realistic request mix and reports
+throughput and latency per route as JSON.
+
+Seeds a throwaway database with --restaurants restaurants, each with a
+--menu-items item menu and --history past orders spread over the last 30
+days, starts gunicorn with gunicorn.conf.py, opens --subscribers /events
+streams spread over the restaurants, then has --clients clients send
+requests for --duration seconds. Each request is picked by weight from
+--mix:
+
+    scan      GET  /customer/<subdomain>          (a diner opening the menu)
+    order     POST /order
+    status    POST /api/order/<id>/status          (admin)
+    add_item  POST /api/order/<id>/add-item        (admin)
+
+Environment variables (ORDER_GROUP_COMMIT, DB_POOL_SIZE, ...) are passed
+through to gunicorn; --shards also splits the database per restaurant.
+--compare checks the run against an earlier --out file and exits non-zero
+if a route got slower or lost throughput by more than --tolerance.
+
+    python bench/loadtest.py --out before.json
+    python bench/loadtest.py --compare before.json
+    python bench/loadtest.py --restaurants 200 --subscribers 500 --shards
+    ORDER_GROUP_COMMIT=1 python bench/loadtest.py --mix order=1
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from stream_latency import ROOT, free_port, login, open_stream, wait_for
+
+ROUTES = ("scan", "order", "status", "add_item")
+DEFAULT_MIX = "scan=50,order=30,status=15,add_item=5"
+STATUSES = ("Preparing", "Ready", "Served")
+CATEGORIES = ("Starters", "Mains", "Breads", "Desserts", "Drinks")
+
+
+# ---------------- SEED ----------------
+def seed(db_path, restaurants, menu_items, history):
+    os.environ["RESTAURANT_DB"] = db_path
+    sys.path.insert(0, ROOT)
+    from db import init_db
+    import stats
+    init_db()
+
+    rng = random.Random(1)
+    password = generate_password_hash("bench")
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO restaurants (id, name, subdomain) VALUES (?, ?, ?)",
+        [(rid, f"Bench {rid}", f"bench{rid}") for rid in range(1, restaurants + 1)]
+    )
+    conn.executemany("""
+        INSERT INTO users (restaurant_id, username, password, role)
+        VALUES (?, ?, ?, 'admin')
+    """, [
+        (rid, f"bench{rid}@example.com", password)
+        for rid in range(1, restaurants + 1)
+    ])
+    conn.executemany("""
+        INSERT INTO menu (restaurant_id, name, price, category, image, available)
+        VALUES (?, ?, ?, ?, '', 1)
+    """, [
+        (rid, f"Dish {n}", rng.randrange(40, 400), CATEGORIES[n % len(CATEGORIES)])
+        for rid in range(1, restaurants + 1)
+        for n in range(1, menu_items + 1)
+    ])
+
+    menus = {}
+    for rid, item_id, name, price in conn.execute(
+        "SELECT restaurant_id, id, name, price FROM menu ORDER BY id"
+    ):
+        menus.setdefault(rid, []).append((item_id, name, price))
+
+    # Past orders, all served, with one to four lines each
+    for rid, menu in menus.items():
+        for _ in range(history):
+            created = f"datetime('now', '-{rng.randrange(1, 30 * 24 * 60)} minutes')"
+            lines = rng.sample(menu, min(len(menu), rng.randint(1, 4)))
+            total = sum(price for _, _, price in lines)
+            order_id = conn.execute(f"""
+                INSERT INTO orders (restaurant_id, table_no, total, status, created_at)
+                VALUES (?, ?, ?, 'Served', {created})
+            """, (rid, rng.randint(1, 20), total)).lastrowid
+            conn.executemany("""
+                INSERT INTO order_items
+                (order_id, restaurant_id, menu_id, name, price, qty, created_at)
+                SELECT ?, ?, ?, ?, ?, 1, created_at FROM orders WHERE id=?
+            """, [
+                (order_id, rid, item_id, name, price, order_id)
+                for item_id, name, price in lines
+            ])
+
+    stats.rebuild(conn)
+    conn.commit()
+    conn.close()
+
+    return {rid: [item_id for item_id, _, _ in menu] for rid, menu in menus.items()}
+
+
+# ---------------- CLIENTS ----------------
+class Recorder:
+    def __init__(self):
+        self.latencies = {route: [] for route in ROUTES}
+        self.errors = {route: {} for route in ROUTES}
+        self._lock = threading.Lock()
+
+    def ok(self, route, ms):
+        with self._lock:
+            self.latencies[route].append(ms)
+
+    def error(self, route, reason):
+        with self._lock:
+            self.errors[route][reason] = self.errors[route].get(reason, 0) + 1
+
+
+def request(port, method, path, body=None, cookie=None):
+    headers = {}
+    if body is not None:
+        body = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    if cookie:
+        headers["Cookie"] = cookie
+
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+    finally:
+        conn.close()
+    return resp.status, data
+
+
+def client(port, deadline, mix, menus, cookies, orders, recorder, seed_value):
+    rng = random.Random(seed_value)
+    routes, weights = zip(*mix.items())
+    rids = list(menus)
+
+    while time.perf_counter() < deadline:
+        route = rng.choices(routes, weights)[0]
+        rid = rng.choice(rids)
+        placed = orders[rid]
+
+        if route == "scan":
+            args = ("GET", f"/customer/bench{rid}")
+        elif route == "order":
+            args = ("POST", "/order", {
+                "restaurant_id": rid,
+                "table": rng.randint(1, 20),
+                "items": [
+                    {"id": item_id, "qty": rng.randint(1, 3)}
+                    for item_id in rng.sample(menus[rid], min(len(menus[rid]), rng.randint(1, 4)))
+                ]
+            })
+        elif not placed:
+            # Nothing to update yet for this restaurant
+            continue
+        elif route == "status":
+            args = ("POST", f"/api/order/{rng.choice(placed)}/status",
+                    {"status": rng.choice(STATUSES)}, cookies[rid])
+        else:
+            args = ("POST", f"/api/order/{rng.choice(placed)}/add-item",
+                    {"item_id": rng.choice(menus[rid]), "qty": 1}, cookies[rid])
+
+        began = time.perf_counter()
+        try:
+            status, data = request(port, *args)
+        except OSError as e:
+            recorder.error(route, type(e).__name__)
+            continue
+        if status != 200:
+            recorder.error(route, str(status))
+            continue
+        recorder.ok(route, (time.perf_counter() - began) * 1000)
+
+        if route == "order":
+            placed.append(json.loads(data)["order_id"])
+
+
+def subscriber(sock, counts, index):
+    # Counts the events a dashboard receives until the socket is closed
+    sock.settimeout(None)
+    try:
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return
+            counts[index] += chunk.count(b"\nevent: ") + chunk.startswith(b"event: ")
+    except OSError:
+        return
+
+
+# ---------------- REPORT ----------------
+def percentile(ordered, p):
+    # Nearest rank
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+def route_summary(latencies, errors, elapsed):
+    result = {
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+    if errors:
+        result["error_kinds"] = errors
+    if latencies:
+        ordered = sorted(latencies)
+        result.update({
+            "p50_ms": round(percentile(ordered, 50), 2),
+            "p95_ms": round(percentile(ordered, 95), 2),
+            "p99_ms": round(percentile(ordered, 99), 2),
+        })
+    return result
+
+
+def compare(result, baseline, tolerance):
+    # Routes that got slower (p95) or lost throughput beyond the tolerance
+    regressions = []
+    for route, now in result["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before or not before.get("requests") or not now.get("requests"):
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+        if now["rps"] < before["rps"] * (1 - tolerance):
+            regressions.append(f"{route}: {before['rps']} -> {now['rps']} req/s")
+        if now["errors"] > before["errors"]:
+            regressions.append(f"{route}: errors {before['errors']} -> {now['errors']}")
+    return regressions
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        route, _, weight = part.partition("=")
+        route = route.strip()
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route {route!r}; pick from {ROUTES}")
+        mix[route] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--restaurants", type=int, default=20)
+    parser.add_argument("--menu-items", type=int, default=40)
+    parser.add_argument("--history", type=int, default=200,
+                        help="past orders per restaurant")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--subscribers", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--shards", action="store_true",
+                        help="one database per restaurant (TENANT_SHARD_DIR)")
+    parser.add_argument("--out", help="also write the JSON result here")
+    parser.add_argument("--compare", help="an earlier --out file to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="qr-bench-")
+    db_path = os.path.join(tmp, "bench.db")
+    menus = seed(db_path, args.restaurants, args.menu_items, args.history)
+
+    port = free_port()
+    env = dict(os.environ, RESTAURANT_DB=db_path, PORT=str(port),
+               WEB_CONCURRENCY=str(args.workers))
+    env.setdefault("WEB_WORKER_CONNECTIONS",
+                   str(max(1000, args.subscribers + args.clients + 100)))
+    if args.shards:
+        env["TENANT_SHARD_DIR"] = os.path.join(tmp, "shards")
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "app", "shard-tenants", "--purge"],
+            cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL
+        )
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    recorder = Recorder()
+    streams, readers = [], []
+    try:
+        wait_for(port)
+        cookies = {rid: login(port, f"bench{rid}%40example.com") for rid in menus}
+
+        counts = [0] * args.subscribers
+        for i in range(args.subscribers):
+            rid = list(menus)[i % len(menus)]
+            streams.append(open_stream(port, cookies[rid]))
+            readers.append(threading.Thread(
+                target=subscriber, args=(streams[-1], counts, i), daemon=True
+            ))
+            readers[-1].start()
+
+        orders = {rid: [] for rid in menus}
+        began = time.perf_counter()
+        deadline = began + args.duration
+        clients = [
+            threading.Thread(target=client, args=(
+                port, deadline, args.mix, menus, cookies, orders, recorder, n
+            ))
+            for n in range(args.clients)
+        ]
+        for t in clients:
+            t.start()
+        for t in clients:
+            t.join()
+        elapsed = time.perf_counter() - began
+    finally:
+        for sock in streams:
+            sock.close()
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    total = sum(len(v) for v in recorder.latencies.values())
+    result = {
+        "config": {
+            "restaurants": args.restaurants,
+            "menu_items": args.menu_items,
+            "history": args.history,
+            "clients": args.clients,
+            "subscribers": args.subscribers,
+            "duration_s": args.duration,
+            "workers": args.workers,
+            "worker_class": env.get("WEB_WORKER_CLASS", "gevent"),
+            "group_commit": env.get("ORDER_GROUP_COMMIT", "0") == "1",
+            "shards": args.shards,
+            "mix": args.mix,
+        },
+        "total_rps": round(total / elapsed, 1),
+        "routes": {
+            route: route_summary(recorder.latencies[route], recorder.errors[route], elapsed)
+            for route in args.mix
+        },
+        "events_received": sum(counts),
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            result["regressions"] = compare(result, json.load(f), args.tolerance)
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+    if any(r["errors"] for r in result["routes"].values()) or result.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
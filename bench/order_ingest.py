@@ -0,0 +1,131 @@
+"""
+Compares /order throughput and latency with and without group commit.
+
+Starts gunicorn with gunicorn.conf.py against a fresh throwaway database
+for each mode (ORDER_GROUP_COMMIT=0, then 1), has --clients concurrent
+clients place --orders orders in total, and reports orders/second plus
+p50/p99 latency. Every order is checked against the database afterwards,
+so a mode that loses or duplicates writes fails the run.
+
+    python bench/order_ingest.py --clients 64 --orders 4000
+    python bench/order_ingest.py --workers 4 --modes group
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from stream_latency import ROOT, free_port, seed, summary, wait_for
+
+MODES = {"direct": "0", "group": "1"}
+
+
+def client(port, count, latencies, errors, start):
+    body = json.dumps({
+        "restaurant_id": 1,
+        "table": 1,
+        "items": [{"id": 1, "qty": 1}]
+    })
+    start.wait()
+    for _ in range(count):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        began = time.perf_counter()
+        try:
+            conn.request("POST", "/order", body=body,
+                         headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+                continue
+        except OSError as e:
+            errors.append(type(e).__name__)
+            continue
+        finally:
+            conn.close()
+        latencies.append((time.perf_counter() - began) * 1000)
+
+
+def run(mode, args, template):
+    db_path = os.path.join(os.path.dirname(template), f"{mode}.db")
+    shutil.copy(template, db_path)
+
+    port = free_port()
+    env = dict(os.environ, RESTAURANT_DB=db_path, PORT=str(port),
+               WEB_CONCURRENCY=str(args.workers),
+               ORDER_GROUP_COMMIT=MODES[mode])
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    latencies, errors = [], []
+    start = threading.Event()
+    per_client = args.orders // args.clients
+    threads = [
+        threading.Thread(target=client, args=(port, per_client, latencies, errors, start))
+        for _ in range(args.clients)
+    ]
+    try:
+        wait_for(port)
+        for t in threads:
+            t.start()
+        began = time.perf_counter()
+        start.set()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - began
+    finally:
+        server.terminate()
+        server.wait()
+
+    conn = sqlite3.connect(db_path)
+    stored = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+    counted = conn.execute("SELECT IFNULL(SUM(order_count), 0) FROM daily_stats").fetchone()[0]
+    conn.close()
+
+    return {
+        "orders_per_sec": round(len(latencies) / elapsed, 1),
+        **summary(latencies),
+        "ok": len(latencies),
+        "errors": len(errors),
+        "stored": stored,
+        "consistent": stored == counted == len(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    result = {
+        "workers": args.workers,
+        "clients": args.clients,
+        "orders": args.orders // args.clients * args.clients,
+    }
+    # seed() imports db.py, which fixes its path on first import, so every
+    # mode starts from a copy of one seeded database
+    template = os.path.join(tempfile.mkdtemp(prefix="qr-bench-"), "seed.db")
+    seed(template)
+    for mode in args.modes:
+        result[mode] = run(mode, args, template)
+    print(json.dumps(result, indent=2))
+
+    if not all(result[m]["consistent"] and not result[m]["errors"] for m in args.modes):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
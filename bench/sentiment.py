@@ -0,0 +1,82 @@
+"""
+Compares comments/second for batch and one-at-a-time sentiment scoring.
+
+Generates --comments synthetic feedback comments, scores them once with a
+call per comment (what scoring on the request path would cost) and once in
+chunks of --batch, the way the feedback worker does. Model loading is done
+up front and excluded from both timings. Exits non-zero if the two modes
+disagree on any score.
+
+    python bench/sentiment.py --comments 20000
+    python bench/sentiment.py --batch 100
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from stream_latency import ROOT
+
+sys.path.insert(0, ROOT)
+import sentiment  # noqa: E402
+
+OPENERS = ["", "The ", "Honestly the ", "Our ", "My "]
+SUBJECTS = ["biryani", "pizza", "dosa", "service", "waiter", "food", "coffee", "naan", "paneer"]
+VERDICTS = [
+    "was delicious", "was cold", "was not good", "came really late", "was very tasty",
+    "was okay", "was stale and bland", "was great", "was overpriced", "was perfect",
+    "took forever", "was rude", "was friendly and quick", "was soggy",
+]
+CLOSERS = ["", ".", "!", ", will come again.", ", never again.", ", thanks!", " but the staff were lovely."]
+
+
+def comments(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        f"{rng.choice(OPENERS)}{rng.choice(SUBJECTS)} {rng.choice(VERDICTS)}{rng.choice(CLOSERS)}"
+        for _ in range(count)
+    ]
+
+
+def timed(fn):
+    began = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - began
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=sentiment.BATCH_SIZE)
+    args = parser.parse_args()
+
+    texts = comments(args.comments)
+    _, load_s = timed(sentiment.model)
+
+    single, single_s = timed(lambda: [sentiment.score([t])[0] for t in texts])
+    batch, batch_s = timed(lambda: [
+        result
+        for i in range(0, len(texts), args.batch)
+        for result in sentiment.score(texts[i:i + args.batch])
+    ])
+
+    labels = [label for _, label in batch]
+    result = {
+        "comments": len(texts),
+        "batch_size": args.batch,
+        "model_load_s": round(load_s, 3),
+        "single": {"seconds": round(single_s, 3), "comments_per_s": round(len(texts) / single_s)},
+        "batch": {"seconds": round(batch_s, 3), "comments_per_s": round(len(texts) / batch_s)},
+        "speedup": round(single_s / batch_s, 1),
+        "labels": {name: labels.count(name) for name in ("positive", "neutral", "negative")},
+        "identical": single == batch,
+    }
+    print(json.dumps(result, indent=2))
+
+    if not result["identical"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
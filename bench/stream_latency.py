@@ -0,0 +1,199 @@
+"""
+Checks that /order latency stays flat while many /events streams are open.
+
+Starts gunicorn with gunicorn.conf.py against a throwaway database, times
+a batch of /order requests with no streams, opens N /events streams and
+times the same batch again. Exits non-zero if the median latency with
+streams open grows past --max-ratio times the baseline.
+
+By default the streams belong to a second, idle restaurant, which is the
+"many dashboards left open" case. --same-restaurant subscribes them to
+the restaurant taking the orders, so every order also fans out to N
+clients.
+
+    python bench/stream_latency.py --streams 500
+    WEB_WORKER_CLASS=sync python bench/stream_latency.py --streams 4
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from werkzeug.security import generate_password_hash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed(db_path):
+    os.environ["RESTAURANT_DB"] = db_path
+    sys.path.insert(0, ROOT)
+    from db import init_db
+    init_db()
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO restaurants (id, name, subdomain) VALUES (?, ?, ?)",
+        [(1, "Bench", "bench"), (2, "Idle", "idle")]
+    )
+    conn.executemany("""
+        INSERT INTO users (restaurant_id, username, password, role)
+        VALUES (?, ?, ?, 'admin')
+    """, [
+        (1, "bench@example.com", generate_password_hash("bench")),
+        (2, "idle@example.com", generate_password_hash("bench")),
+    ])
+    conn.execute(
+        "INSERT INTO menu (id, restaurant_id, name, price, category) VALUES (1, 1, 'Tea', 10, 'Drinks')"
+    )
+    conn.commit()
+    conn.close()
+
+
+def wait_for(port, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("gunicorn did not start")
+
+
+def login(port, username):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request(
+        "POST", "/login",
+        body=f"username={username}&password=bench",
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    resp = conn.getresponse()
+    resp.read()
+    cookie = resp.getheader("Set-Cookie").split(";", 1)[0]
+    conn.close()
+    return cookie
+
+
+def open_stream(port, cookie):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=10)
+    sock.sendall(
+        f"GET /events HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n"
+        f"Accept: text/event-stream\r\n\r\n".encode()
+    )
+    # Wait for the initial snapshot so the stream is really being served
+    buf = b""
+    while b"event: snapshot" not in buf:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise RuntimeError("stream closed early")
+        buf += chunk
+    return sock
+
+
+def time_orders(port, count, timeout):
+    body = json.dumps({
+        "restaurant_id": 1,
+        "table": 1,
+        "items": [{"id": 1, "qty": 1}]
+    })
+    latencies = []
+    for _ in range(count):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        start = time.perf_counter()
+        try:
+            conn.request("POST", "/order", body=body,
+                         headers={"Content-Type": "application/json"})
+            conn.getresponse().read()
+        except (socket.timeout, OSError):
+            return None
+        finally:
+            conn.close()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summary(latencies):
+    if latencies is None:
+        return {"starved": True}
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--max-ratio", type=float, default=3.0)
+    parser.add_argument("--timeout", type=float, default=5.0)
+    parser.add_argument("--same-restaurant", action="store_true")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="qr-bench-")
+    db_path = os.path.join(tmp, "bench.db")
+    seed(db_path)
+
+    port = free_port()
+    env = dict(os.environ, RESTAURANT_DB=db_path, PORT=str(port),
+               WEB_CONCURRENCY=str(args.workers))
+    # Leave room for the /order connections next to the open streams
+    env.setdefault("WEB_WORKER_CONNECTIONS", str(max(1000, args.streams + 100)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    streams = []
+    try:
+        wait_for(port)
+        user = "bench" if args.same_restaurant else "idle"
+        cookie = login(port, f"{user}%40example.com")
+
+        baseline = time_orders(port, args.orders, args.timeout)
+        for _ in range(args.streams):
+            try:
+                streams.append(open_stream(port, cookie))
+            except OSError:
+                # No worker left to serve another stream (sync workers)
+                break
+        loaded = time_orders(port, args.orders, args.timeout)
+    finally:
+        for sock in streams:
+            sock.close()
+        server.terminate()
+        server.wait()
+
+    result = {
+        "worker_class": env.get("WEB_WORKER_CLASS", "gevent"),
+        "workers": args.workers,
+        "streams": len(streams),
+        "same_restaurant": args.same_restaurant,
+        "baseline": summary(baseline),
+        "with_streams": summary(loaded),
+    }
+    print(json.dumps(result, indent=2))
+
+    if loaded is None or baseline is None or len(streams) < args.streams:
+        sys.exit(1)
+    if statistics.median(loaded) > statistics.median(baseline) * args.max_ratio:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import hashlib
+import io
+import json
+import os
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from reportlab.pdfgen import canvas
+
+from db import items_by_order
+from lru import LRUCache
+from workers import pool_map
+
+GST_RATE = 0.05
+
+# Rendered bills kept per process. A bill PDF is a couple of KB, so the
+# default costs a few MB at most.
+MAX_CACHED_BILLS = int(os.environ.get("BILL_CACHE_SIZE", 1024))
+
+# Below this many bills the pool start-up costs more than it saves
+POOL_THRESHOLD = 200
+
+# Longest range the batch export accepts, in days
+MAX_EXPORT_DAYS = 92
+
+
+# ---------------- BILL DATA ----------------
+def make_bill(order, items):
+    # Everything the PDF shows, as plain data: picklable for the pool and
+    # hashable into a fingerprint for the cache.
+    subtotal = sum(i["price"] * i["qty"] for i in items)
+    gst = round(subtotal * GST_RATE, 2)
+
+    return {
+        "restaurant_id": order["restaurant_id"],
+        "order_id": order["id"],
+        "restaurant_name": order["restaurant_name"],
+        "table_no": order["table_no"],
+        "created_at": order["created_at"],
+        "items": [
+            {"name": i["name"], "qty": i["qty"], "price": i["price"]}
+            for i in items
+        ],
+        "subtotal": subtotal,
+        "gst": gst,
+        "total": round(subtotal + gst, 2),
+    }
+
+
+def load_bills(db, restaurant_id, start, end):
+    # Bills for every order placed in [start, end), oldest first, in two
+    # queries regardless of how many orders the range holds.
+    orders = db.execute("""
+        SELECT o.id, o.restaurant_id, o.table_no, o.created_at, r.name AS restaurant_name
+        FROM orders o
+        JOIN restaurants r ON r.id = o.restaurant_id
+        WHERE o.restaurant_id=?
+        AND o.created_at >= ? AND o.created_at < ?
+        ORDER BY o.created_at, o.id
+    """, (restaurant_id, start, end)).fetchall()
+
+    lines = items_by_order(db, restaurant_id, start, end)
+    return [make_bill(o, lines.get(o["id"], [])) for o in orders]
+
+
+def fingerprint(bill):
+    # Changes whenever anything printed on the bill changes (items added,
+    # restaurant renamed), which is what invalidates a cached PDF.
+    data = json.dumps(bill, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+# ---------------- RENDERING ----------------
+def draw_bill(c, bill):
+    c.drawString(100, 780, bill["restaurant_name"])
+    c.drawString(100, 760, f"Table: {bill['table_no']}")
+    c.drawString(350, 780, f"Bill #{bill['order_id']}")
+    c.drawString(350, 760, str(bill["created_at"]))
+
+    y = 720
+    for i in bill["items"]:
+        if y < 80:
+            c.showPage()
+            y = 780
+        c.drawString(100, y, f"{i['name']} x {i['qty']} = ₹{i['price'] * i['qty']}")
+        y -= 20
+
+    c.drawString(100, y - 20, f"Subtotal: ₹{bill['subtotal']}")
+    c.drawString(100, y - 40, f"GST: ₹{bill['gst']}")
+    c.drawString(100, y - 60, f"Total: ₹{bill['total']}")
+
+
+def render_pdf(bill):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    c.setTitle(f"Bill {bill['order_id']}")
+    draw_bill(c, bill)
+    c.save()
+    return buf.getvalue()
+
+
+# (restaurant_id, order_id) -> (fingerprint, PDF bytes). Keyed by
+# restaurant too: with shards, order ids repeat across restaurants.
+bill_cache = LRUCache(MAX_CACHED_BILLS)
+
+
+def cached_pdf(key, fp):
+    # Only while the bill is unchanged since it was rendered
+    entry = bill_cache.get(key)
+    return entry[1] if entry and entry[0] == fp else None
+
+
+def pdfs(bills, store=True):
+    # PDF bytes per bill, from the cache where the bill is unchanged and
+    # rendered across the process pool otherwise. Batch exports pass
+    # store=False so a month of bills does not evict everyone's recent ones.
+    fps = [fingerprint(b) for b in bills]
+    keys = [(b["restaurant_id"], b["order_id"]) for b in bills]
+    out = [cached_pdf(key, fp) for key, fp in zip(keys, fps)]
+
+    missing = [i for i, data in enumerate(out) if data is None]
+    rendered = pool_map(render_pdf, [bills[i] for i in missing], POOL_THRESHOLD)
+    for i, data in zip(missing, rendered):
+        if store:
+            bill_cache.put(keys[i], (fps[i], data))
+        out[i] = data
+
+    return out
+
+
+def pdf(bill):
+    return pdfs([bill])[0]
+
+
+# ---------------- BATCH EXPORT ----------------
+def combined_pdf(bills):
+    # One document, each bill starting on a new page. Drawing a bill takes
+    # under a millisecond, so a single canvas beats splitting the work
+    # and stitching PDFs back together.
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf)
+    for bill in bills:
+        draw_bill(c, bill)
+        c.showPage()
+    c.save()
+    buf.seek(0)
+    return buf
+
+
+def bills_zip(bills):
+    buf = io.BytesIO()
+    with ZipFile(buf, "w", ZIP_DEFLATED) as zipf:
+        for bill, data in zip(bills, pdfs(bills, store=False)):
+            zipf.writestr(f"bill_{bill['order_id']}.pdf", data)
+    buf.seek(0)
+    return buf
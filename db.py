@@ -1,24 +1,112 @@
 import sqlite3
 import os
+import json
+import threading
+import time
+from datetime import date, timedelta
 from flask import g
 
+import metrics
+import stats
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "restaurant.db")
+DB_PATH = os.environ.get("RESTAURANT_DB", os.path.join(BASE_DIR, "restaurant.db"))
+
+# ---------------- CONNECTION SETTINGS ----------------
+# Applied once when a connection is opened, not on every request.
+BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 10000))
+# Page cache per connection, in KiB (SQLite's default is 2 MiB)
+CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 16384))
+# Bytes of the database file read through mmap instead of read() calls
+MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 256 * 1024 * 1024))
+# Idle connections kept per process; busier moments open extra ones,
+# which are closed again when returned.
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 16))
+
+
+def connect(path=DB_PATH):
+    # Every connection in the app (requests, the SSE hub, the order
+    # writer, init_db) comes from here, with the same path and settings.
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        factory=metrics.connection_factory()
+    )
+    conn.row_factory = sqlite3.Row
+
+    # WAL mode for concurrency
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS};")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB};")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE};")
+    return conn
+
+
+# ---------------- CONNECTION POOL ----------------
+class ConnectionPool:
+    def __init__(self, path=DB_PATH, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.opened = 0
+        self.reused = 0
+        self.closed = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's connections are not ours to use
+                self._idle, self._pid, self.in_use = [], os.getpid(), 0
+
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self._idle:
+                self.reused += 1
+                return self._idle.pop()
+            self.opened += 1
+
+        return connect(self.path)
+
+    def release(self, conn):
+        # A request that failed halfway must not hand its open
+        # transaction (and write lock) to the next one.
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            self.in_use -= 1
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self.closed += 1
+        conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "idle": len(self._idle),
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "opened": self.opened,
+                "reused": self.reused,
+                "closed": self.closed,
+            }
+
+
+pool = ConnectionPool()
+
 
 # ---------------- DB CONNECTION ----------------
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(
-            DB_PATH,
-            timeout=10,
-            check_same_thread=False
-        )
-        g.db.row_factory = sqlite3.Row
-
-        # WAL mode for concurrency
-        g.db.execute("PRAGMA journal_mode=WAL;")
-        g.db.execute("PRAGMA synchronous=NORMAL;")
-
+        g.db = pool.acquire()
     return g.db
 
 
@@ -26,12 +114,117 @@ def get_db():
 def close_db(e=None):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        pool.release(db)
+
+
+# ---------------- DATE RANGES ----------------
+def day_range(first, last=None):
+    # created_at is stored as 'YYYY-MM-DD HH:MM:SS' (UTC). Comparing it
+    # against a half-open [first, last + 1 day) text range keeps
+    # idx_orders_restaurant_created usable, where DATE(created_at)=?
+    # forces a scan of every order the restaurant ever had.
+    start = date.fromisoformat(first)
+    end = date.fromisoformat(last) if last else start
+
+    if end < start:
+        raise ValueError("end date before start date")
+
+    return start.isoformat(), (end + timedelta(days=1)).isoformat()
+
+
+def requested_days(args, default=None):
+    # ?from=YYYY-MM-DD&to=YYYY-MM-DD, both inclusive, `to` defaulting to
+    # `from` -> (first, last, start, end), with [start, end) from
+    # day_range. The ValueError message is meant for the 400 response.
+    first = args.get("from") or default
+    last = args.get("to") or first
+    if not first:
+        raise ValueError("Date required")
+    try:
+        start, end = day_range(first, last)
+    except ValueError:
+        raise ValueError("Invalid date range") from None
+    return first, last, start, end
+
+
+def today():
+    # Current UTC date: the calendar created_at is stored in
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+# ---------------- ORDER ITEMS ----------------
+def items_for_order(db, order_id):
+    rows = db.execute("""
+        SELECT id, menu_id, name, price, qty
+        FROM order_items
+        WHERE order_id=?
+        ORDER BY id
+    """, (order_id,)).fetchall()
+
+    return [dict(r) for r in rows]
+
+
+def items_by_order(db, restaurant_id, start, end):
+    # Lines of every order placed in [start, end), keyed by order id, in
+    # one indexed join instead of one JSON blob per order.
+    rows = db.execute("""
+        SELECT oi.id, oi.order_id, oi.menu_id, oi.name, oi.price, oi.qty
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        WHERE o.restaurant_id=?
+        AND o.created_at >= ? AND o.created_at < ?
+        ORDER BY oi.id
+    """, (restaurant_id, start, end)).fetchall()
+
+    grouped = {}
+    for r in rows:
+        line = dict(r)
+        grouped.setdefault(line.pop("order_id"), []).append(line)
+    return grouped
+
+
+def migrate_order_items(c):
+    # Explode legacy orders.items JSON into order_items rows. items is
+    # cleared afterwards, so this only ever touches unmigrated orders,
+    # found through idx_orders_legacy_items.
+    legacy = c.execute("""
+        SELECT id, restaurant_id, items, created_at
+        FROM orders
+        WHERE items IS NOT NULL
+        ORDER BY id
+    """).fetchall()
+
+    for order_id, restaurant_id, items, created_at in legacy:
+        try:
+            lines = json.loads(items) or []
+        except ValueError:
+            lines = []
+
+        c.executemany("""
+            INSERT INTO order_items
+            (order_id, restaurant_id, menu_id, name, price, qty, created_at)
+            VALUES (?,?,?,?,?,?,?)
+        """, [
+            (order_id, restaurant_id, i.get("id"), i.get("name", ""),
+             i.get("price", 0), i.get("qty", 0), created_at)
+            for i in lines
+        ])
+        c.execute("UPDATE orders SET items=NULL WHERE id=?", (order_id,))
+
+
+# ---------------- MIGRATIONS ----------------
+def add_column(c, table, column, ddl):
+    # CREATE TABLE IF NOT EXISTS leaves existing tables alone, so new
+    # columns on old databases are added here.
+    columns = [row[1] for row in c.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
 
 
 # ---------------- INIT DB ----------------
-def init_db():
-    db = sqlite3.connect(DB_PATH)
+def init_db(path=DB_PATH):
+    # Also used to create and migrate per-restaurant shard files
+    db = connect(path)
     c = db.cursor()
 
     # ================= RESTAURANTS =================
@@ -43,9 +236,13 @@ def init_db():
         gstin TEXT,
         address TEXT,
         phone TEXT,
+        menu_version INTEGER NOT NULL DEFAULT 0,
+        printer_url TEXT,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )
     """)
+    add_column(c, "restaurants", "menu_version", "INTEGER NOT NULL DEFAULT 0")
+    add_column(c, "restaurants", "printer_url", "TEXT")
 
     # ================= USERS =================
     c.execute("""
@@ -69,12 +266,110 @@ def init_db():
         price REAL NOT NULL,
         category TEXT,
         image TEXT,
+        image_thumb TEXT,
+        image_medium TEXT,
         available INTEGER DEFAULT 1,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
     )
     """)
 
+    add_column(c, "menu", "image_thumb", "TEXT")
+    add_column(c, "menu", "image_medium", "TEXT")
+
+    # ================= IMAGE JOBS (UPLOAD PIPELINE) =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS image_jobs (
+        hash TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        thumb TEXT,
+        medium TEXT,
+        error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        done_at DATETIME
+    )
+    """)
+
+    # ================= PRINT JOBS (ESC/POS QUEUE) =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS print_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        restaurant_id INTEGER NOT NULL,
+        order_id INTEGER NOT NULL,
+        target TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        next_attempt_at DATETIME,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        printed_at DATETIME,
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    )
+    """)
+    add_column(c, "print_jobs", "next_attempt_at", "DATETIME")
+
+    # ================= FEEDBACK =================
+    # One per order. Sentiment columns stay NULL until the feedback worker
+    # has scored the comment in a batch, and for rating-only feedback.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL UNIQUE,
+        restaurant_id INTEGER NOT NULL,
+        rating INTEGER,
+        comment TEXT,
+        sentiment REAL,
+        sentiment_label TEXT,
+        sentiment_model TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        scored_at DATETIME,
+        FOREIGN KEY (order_id) REFERENCES orders(id),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    )
+    """)
+
+    # ================= FEEDBACK KEYWORDS =================
+    # Maintained by keywords.py as comments are scored: per-day document
+    # counts per term (for any period or sliding window), all-time document
+    # frequencies (the IDF side, where term '' counts every comment), and
+    # the last computed top keywords per period.
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS feedback_terms (
+        restaurant_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        term TEXT NOT NULL,
+        docs INTEGER NOT NULL DEFAULT 0,
+        negative_docs INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, day, term),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    ) WITHOUT ROWID
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS feedback_term_totals (
+        restaurant_id INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        docs INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, term),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    ) WITHOUT ROWID
+    """)
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS keyword_cache (
+        restaurant_id INTEGER NOT NULL,
+        period TEXT NOT NULL,
+        until TEXT NOT NULL,
+        docs INTEGER NOT NULL,
+        result TEXT NOT NULL,
+        computed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (restaurant_id, period),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    ) WITHOUT ROWID
+    """)
+
     # ================= ORDERS =================
     c.execute("""
     CREATE TABLE IF NOT EXISTS orders (
@@ -84,10 +379,12 @@ def init_db():
         items TEXT,
         total REAL,
         status TEXT DEFAULT 'Received',
+        feedback_token TEXT,
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
     )
     """)
+    add_column(c, "orders", "feedback_token", "TEXT")
 
     # ================= ORDER ADDITIONS (🔥 REQUIRED) =================
     c.execute("""
@@ -106,10 +403,91 @@ def init_db():
     )
     """)
 
+    # ================= ORDER ITEMS =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        restaurant_id INTEGER NOT NULL,
+        menu_id INTEGER,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        qty INTEGER NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (order_id) REFERENCES orders(id),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    )
+    """)
+
+    # ================= DAILY STATS (ROLLUP) =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS daily_stats (
+        restaurant_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        pending_count INTEGER NOT NULL DEFAULT 0,
+        served_revenue REAL NOT NULL DEFAULT 0,
+        gross_revenue REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (restaurant_id, day),
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    ) WITHOUT ROWID
+    """)
+
+    # ================= RESTAURANT TOTALS (PLATFORM PAGE) =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS restaurant_totals (
+        restaurant_id INTEGER PRIMARY KEY,
+        order_count INTEGER NOT NULL DEFAULT 0,
+        gross_revenue REAL NOT NULL DEFAULT 0,
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    )
+    """)
+
+    # ================= CHANGE VERSIONS (SSE HUB) =================
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS change_versions (
+        restaurant_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY (restaurant_id) REFERENCES restaurants(id)
+    )
+    """)
+
     # ================= INDEXES (PERFORMANCE) =================
-    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_restaurant ON orders(restaurant_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_restaurant ON order_additions(restaurant_id)")
-    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_status ON order_additions(status)")
+    # (restaurant_id, created_at) serves both per-restaurant lookups and
+    # date ranges, so the old single-column index is redundant.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_orders_restaurant_created ON orders(restaurant_id, created_at)")
+    c.execute("DROP INDEX IF EXISTS idx_orders_restaurant")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items(order_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_order_items_restaurant_created ON order_items(restaurant_id, created_at)")
+    # The kitchen queue reads one restaurant's 'New' additions oldest
+    # first; this serves filter and sort, replacing two single-column ones.
+    c.execute("CREATE INDEX IF NOT EXISTS idx_additions_restaurant_status ON order_additions(restaurant_id, status, created_at)")
+    c.execute("DROP INDEX IF EXISTS idx_additions_restaurant")
+    c.execute("DROP INDEX IF EXISTS idx_additions_status")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_image_jobs_status ON image_jobs(status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_menu_image ON menu(image)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_print_jobs_status ON print_jobs(status, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_totals_orders ON restaurant_totals(order_count, restaurant_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_totals_revenue ON restaurant_totals(gross_revenue, restaurant_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedback_restaurant_created ON feedback(restaurant_id, created_at)")
+    # Only the worker's queue of unscored comments, which stays small
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_feedback_unscored ON feedback(id)
+        WHERE sentiment IS NULL AND comment IS NOT NULL
+    """)
+    # Orders still holding legacy items JSON. Empty once they are migrated,
+    # so the check on every start reads this index instead of all orders.
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_legacy_items ON orders(id)
+        WHERE items IS NOT NULL
+    """)
+
+    migrate_order_items(c)
+
+    # First run with the rollup table: backfill it from existing orders
+    if not c.execute("SELECT 1 FROM daily_stats LIMIT 1").fetchone():
+        stats.rebuild(c)
+    stats.fill_totals(c)
 
     db.commit()
     db.close()
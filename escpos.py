@@ -0,0 +1,99 @@
+# Raw ESC/POS receipts for 58 mm thermal printers, the same layout as
+# bill_thermal.html but as bytes the printer consumes directly.
+
+COLUMNS = 32          # Font A on a 58 mm roll
+ENCODING = "cp437"    # the code page printers start in after ESC @
+CURRENCY = "Rs."      # cp437 has no rupee sign
+
+INIT = b"\x1b@"
+ALIGN_LEFT = b"\x1ba\x00"
+ALIGN_CENTER = b"\x1ba\x01"
+BOLD_ON = b"\x1bE\x01"
+BOLD_OFF = b"\x1bE\x00"
+DOUBLE_ON = b"\x1d!\x11"
+DOUBLE_OFF = b"\x1d!\x00"
+CUT = b"\x1dVB\x03"   # feed 3 lines, then partial cut
+
+RULE = b"-" * COLUMNS + b"\n"
+
+
+def _text(value):
+    return str(value if value is not None else "").encode(ENCODING, "replace")
+
+
+def _line(value):
+    return _text(value)[:COLUMNS] + b"\n"
+
+
+def _columns(left, right):
+    left, right = _text(left), _text(right)
+    space = max(1, COLUMNS - len(left) - len(right))
+    return (left + b" " * space + right)[:COLUMNS] + b"\n"
+
+
+def _money(amount):
+    return f"{amount:.2f}"
+
+
+def receipt(order, items):
+    # order needs name, address, phone, gstin, table_no, created_at
+    subtotal = sum(i["price"] * i["qty"] for i in items)
+    cgst = round(subtotal * 0.025, 2)
+    sgst = round(subtotal * 0.025, 2)
+
+    return {
+        "name": order["name"],
+        "address": order["address"],
+        "phone": order["phone"],
+        "gstin": order["gstin"],
+        "table_no": order["table_no"],
+        "created_at": order["created_at"],
+        "items": [
+            {"name": i["name"], "qty": i["qty"], "price": i["price"]}
+            for i in items
+        ],
+        "subtotal": subtotal,
+        "cgst": cgst,
+        "sgst": sgst,
+        "total": round(subtotal + cgst + sgst, 2),
+    }
+
+
+def render(r):
+    out = [
+        INIT,
+        ALIGN_CENTER, BOLD_ON, DOUBLE_ON, _line(r["name"][:COLUMNS // 2]),
+        DOUBLE_OFF, BOLD_OFF,
+    ]
+
+    # Wrap the address rather than losing the end of it
+    address = _text(r["address"])
+    for start in range(0, len(address), COLUMNS):
+        out.append(address[start:start + COLUMNS] + b"\n")
+
+    out += [
+        _line(f"Ph: {r['phone'] or ''}"),
+        _line(f"GSTIN: {r['gstin'] or ''}"),
+        ALIGN_LEFT, RULE,
+        _line(f"Table: {r['table_no']}"),
+        _line(f"Date: {r['created_at']}"),
+        RULE,
+    ]
+
+    for i in r["items"]:
+        out.append(_line(i["name"]))
+        out.append(_columns(f"  {i['qty']} x {_money(i['price'])}", _money(i["qty"] * i["price"])))
+
+    out += [
+        RULE,
+        _columns("Subtotal", f"{CURRENCY} {_money(r['subtotal'])}"),
+        _columns("CGST 2.5%", f"{CURRENCY} {_money(r['cgst'])}"),
+        _columns("SGST 2.5%", f"{CURRENCY} {_money(r['sgst'])}"),
+        RULE,
+        BOLD_ON, _columns("TOTAL", f"{CURRENCY} {_money(r['total'])}"), BOLD_OFF,
+        RULE,
+        ALIGN_CENTER, b"Thank you!\nVisit again\n",
+        CUT,
+    ]
+
+    return b"".join(out)
@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+# --------------------------------------------------
+# WORKERS
+# --------------------------------------------------
+# /events responses stay open for as long as a dashboard is on screen.
+# With gevent each one is a parked greenlet instead of a whole sync
+# worker, so thousands of idle streams share a worker with /order and
+# /customer/<restaurant> traffic. Set WEB_WORKER_CLASS=sync to go back
+# to the old behaviour (one blocked worker per open stream).
+
+worker_class = os.environ.get("WEB_WORKER_CLASS", "gevent")
+
+# SQLite's busy handler sleeps in C, where gevent cannot switch away: while
+# one write waits for the lock, every greenlet on that worker (open /events
+# streams included) is frozen. Under gevent the wait is therefore kept
+# short; a write that still cannot get the lock fails with "database is
+# locked" instead of stalling the whole worker, and app.py answers it with
+# a JSON 503 and Retry-After that the pages show so it can be retried.
+# WAL writes hold the lock for milliseconds, so this is rare outside long
+# migrations.
+if worker_class == "gevent":
+    os.environ.setdefault("DB_BUSY_TIMEOUT_MS", "250")
+workers = int(os.environ.get(
+    "WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 4)
+))
+# Concurrent connections (streams included) per gevent worker
+worker_connections = int(os.environ.get("WEB_WORKER_CONNECTIONS", 1000))
+
+# Async workers heartbeat from their event loop, so an open stream
+# never trips the timeout; it only catches a truly wedged worker.
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+graceful_timeout = 10
+keepalive = 5
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import re
+
+from PIL import Image, ImageOps
+
+import menu_cache
+
+UPLOAD_FOLDER = "static/uploads"
+
+# name -> longest edge in pixels. The customer card shows images at 96 CSS
+# px, so the thumbnail covers 2x screens; medium is for detail views.
+VARIANTS = {
+    "thumb": 192,
+    "medium": 800,
+}
+WEBP_QUALITY = 80
+
+ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+# Content-addressed names never change meaning, so they can be cached
+# forever: <sha256>.<ext> originals and <sha256>_<variant>.webp.
+HASHED_NAME = re.compile(r"^uploads/[0-9a-f]{64}(_[a-z]+)?\.[a-z]+$")
+
+
+def is_immutable(filename):
+    return bool(HASHED_NAME.match(filename.replace("\\", "/")))
+
+
+# ---------------- REQUEST SIDE ----------------
+def store_upload(db, upload):
+    return store_image(db, upload.read(), upload.filename)
+
+
+def store_image(db, data, filename):
+    # Saves image bytes under their content hash and queues them for
+    # resizing. Identical images share one file and one set of variants.
+    digest = hashlib.sha256(data).hexdigest()
+
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in ALLOWED_EXTENSIONS:
+        ext = ".jpg"
+
+    path = os.path.join(UPLOAD_FOLDER, digest + ext)
+    if not os.path.exists(path):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    db.execute("""
+        INSERT OR IGNORE INTO image_jobs (hash, source, status)
+        VALUES (?, ?, 'pending')
+    """, (digest, path))
+
+    return path
+
+
+def variants_for(db, path):
+    # (thumb, medium) paths if this image was already processed.
+    row = db.execute("""
+        SELECT thumb, medium FROM image_jobs
+        WHERE source=? AND status='done'
+    """, (path,)).fetchone()
+    return (row[0], row[1]) if row else (None, None)
+
+
+# ---------------- WORKER SIDE ----------------
+def render_variants(source, digest):
+    paths = {}
+    with Image.open(source) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+
+        for name, edge in VARIANTS.items():
+            out = os.path.join(UPLOAD_FOLDER, f"{digest}_{name}.webp")
+            if not os.path.exists(out):
+                copy = img.copy()
+                copy.thumbnail((edge, edge), Image.LANCZOS)
+                copy.save(out, "WEBP", quality=WEBP_QUALITY, method=4)
+            paths[name] = out
+    return paths
+
+
+def process_pending(db, limit=20):
+    # Renders up to `limit` queued images and points every menu row that
+    # uses them at the new variants. Returns how many jobs were handled.
+    jobs = db.execute("""
+        SELECT hash, source FROM image_jobs
+        WHERE status='pending'
+        ORDER BY created_at
+        LIMIT ?
+    """, (limit,)).fetchall()
+
+    for digest, source in jobs:
+        try:
+            paths = render_variants(source, digest)
+        except (OSError, ValueError) as e:
+            db.execute("""
+                UPDATE image_jobs SET status='failed', error=?, done_at=CURRENT_TIMESTAMP
+                WHERE hash=?
+            """, (str(e)[:200], digest))
+            db.commit()
+            continue
+
+        db.execute("""
+            UPDATE image_jobs
+            SET status='done', thumb=?, medium=?, done_at=CURRENT_TIMESTAMP
+            WHERE hash=?
+        """, (paths["thumb"], paths["medium"], digest))
+
+        restaurants = [r[0] for r in db.execute(
+            "SELECT DISTINCT restaurant_id FROM menu WHERE image=?", (source,)
+        )]
+        db.execute("""
+            UPDATE menu SET image_thumb=?, image_medium=?
+            WHERE image=?
+        """, (paths["thumb"], paths["medium"], source))
+        for rid in restaurants:
+            menu_cache.bump_version(db, rid)
+
+        db.commit()
+
+    return len(jobs)
+
+
+# ---------------- BACKFILL ----------------
+def backfill(dbs, references=None):
+    # Moves legacy {time}_{filename} uploads to content-hash names, repoints
+    # the menu rows, removes the old file and queues the variants. dbs are
+    # the connections to migrate (one per shard). A cloned menu can share
+    # an upload with another restaurant, so a file is only removed once no
+    # menu in `references` (default: dbs) points at it any more.
+    references = dbs if references is None else references
+    moved = 0
+    for db in dbs:
+        legacy = [r[0] for r in db.execute("""
+            SELECT DISTINCT image FROM menu
+            WHERE image IS NOT NULL AND image <> ''
+        """)]
+
+        for old in legacy:
+            if is_immutable(os.path.relpath(old, "static")) or not os.path.exists(old):
+                continue
+
+            with open(old, "rb") as f:
+                new = store_image(db, f.read(), old)
+
+            thumb, medium = variants_for(db, new)
+            restaurants = [r[0] for r in db.execute(
+                "SELECT DISTINCT restaurant_id FROM menu WHERE image=?", (old,)
+            )]
+            db.execute("""
+                UPDATE menu SET image=?, image_thumb=?, image_medium=?
+                WHERE image=?
+            """, (new, thumb, medium, old))
+            for rid in restaurants:
+                menu_cache.bump_version(db, rid)
+            db.commit()
+
+            if new != old and not any(
+                other.execute("SELECT 1 FROM menu WHERE image=? LIMIT 1", (old,)).fetchone()
+                for other in references
+            ):
+                os.remove(old)
+            moved += 1
+
+    return moved
@@ -0,0 +1,271 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from datetime import date, timedelta
+
+from db import today
+
+# Feedback keywords without refitting TF-IDF over a restaurant's history.
+# Each comment is split into terms once, when the feedback worker scores
+# it, and only counters change:
+#   feedback_terms        comments per (day, term), and how many were negative
+#   feedback_term_totals  all-time comments per term, i.e. document frequency
+# Terms are table keys rather than columns of a fitted vocabulary, so new
+# words need no refit. A period's TF-IDF reads only that period's days,
+# and the worker keeps results in keyword_cache for dashboards to read.
+TOP_KEYWORDS = 15
+# period -> days ending today; None for all time
+PERIODS = {"today": 1, "7d": 7, "30d": 30, "all": None}
+
+# Trending complaints compare the last TREND_DAYS with the
+# TREND_BASELINE_DAYS before them, so they read a fixed number of days
+# however long the history is.
+TREND_DAYS = int(os.environ.get("KEYWORD_TREND_DAYS", 7))
+TREND_BASELINE_DAYS = TREND_DAYS * 4
+TREND_MIN_COMMENTS = 2
+
+# The term every comment contains: its counts are comment counts
+ALL = ""
+
+_TOKEN = re.compile(r"(?u)\b\w\w+\b")
+_vocab = None
+
+
+# ---------------- TERMS ----------------
+def _words():
+    # (stop words, negations), loaded by the worker on first use
+    global _vocab
+    if _vocab is None:
+        from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+        from sentiment import NEGATIONS
+        _vocab = (ENGLISH_STOP_WORDS - set(NEGATIONS), set(NEGATIONS))
+    return _vocab
+
+
+def terms(text):
+    # Distinct terms of one comment: words other than stop words, with a
+    # negation attached to the word after it ("not fresh"), so "fresh"
+    # does not turn up among the complaints.
+    stop, negations = _words()
+    found = set()
+    negated_at = None
+    for i, word in enumerate(_TOKEN.findall(text.lower())):
+        if word in negations:
+            negated_at = i
+            continue
+        if word in stop or word.isdigit():
+            continue
+        # "not very fresh" still counts; a negation further back does not
+        if negated_at is not None and i - negated_at <= 2:
+            word = f"not {word}"
+        negated_at = None
+        found.add(word)
+    return found
+
+
+# ---------------- INCREMENTAL UPDATES ----------------
+def add(db, scored):
+    # scored: (restaurant_id, created_at, comment, label) for comments the
+    # worker has just scored. Runs in the worker's transaction, so counts
+    # commit together with the scores. Returns the restaurants touched.
+    per_day = Counter()
+    negative = Counter()
+    totals = Counter()
+    for restaurant_id, created_at, comment, label in scored:
+        day = created_at[:10]
+        for term in terms(comment) | {ALL}:
+            per_day[restaurant_id, day, term] += 1
+            totals[restaurant_id, term] += 1
+            if label == "negative":
+                negative[restaurant_id, day, term] += 1
+
+    db.executemany("""
+        INSERT INTO feedback_terms (restaurant_id, day, term, docs, negative_docs)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(restaurant_id, day, term) DO UPDATE SET
+            docs = docs + excluded.docs,
+            negative_docs = negative_docs + excluded.negative_docs
+    """, [(*key, count, negative[key]) for key, count in per_day.items()])
+
+    db.executemany("""
+        INSERT INTO feedback_term_totals (restaurant_id, term, docs)
+        VALUES (?, ?, ?)
+        ON CONFLICT(restaurant_id, term) DO UPDATE SET
+            docs = docs + excluded.docs
+    """, [(*key, count) for key, count in totals.items()])
+
+    return {restaurant_id for restaurant_id, _ in totals}
+
+
+def rebuild(db, chunk=1000):
+    # Recounts everything from the scored comments: for feedback scored
+    # before keywords were kept, or after changing terms().
+    for table in ("feedback_terms", "feedback_term_totals", "keyword_cache"):
+        db.execute(f"DELETE FROM {table}")
+
+    last_id = 0
+    restaurants = set()
+    while True:
+        rows = db.execute("""
+            SELECT id, restaurant_id, created_at, comment, sentiment_label
+            FROM feedback
+            WHERE id > ? AND sentiment IS NOT NULL AND comment IS NOT NULL
+            ORDER BY id
+            LIMIT ?
+        """, (last_id, chunk)).fetchall()
+        if not rows:
+            break
+        restaurants |= add(db, [tuple(r)[1:] for r in rows])
+        last_id = rows[-1]["id"]
+    return restaurants
+
+
+# ---------------- READS ----------------
+def days_back(until, days):
+    # First day of the `days` days ending with `until`
+    return (date.fromisoformat(until) - timedelta(days=days - 1)).isoformat()
+
+
+def comment_count(db, restaurant_id):
+    row = db.execute(
+        "SELECT docs FROM feedback_term_totals WHERE restaurant_id=? AND term=?",
+        (restaurant_id, ALL)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def top_keywords(db, restaurant_id, period, until, limit=TOP_KEYWORDS):
+    # Comments mentioning the term in the period, times the smoothed IDF
+    # TfidfVectorizer would use: ln((1 + n) / (1 + df)) + 1.
+    days = PERIODS[period]
+    if days is None:
+        rows = db.execute("""
+            SELECT term, docs, docs AS df
+            FROM feedback_term_totals
+            WHERE restaurant_id=?
+        """, (restaurant_id,)).fetchall()
+    else:
+        rows = db.execute("""
+            SELECT t.term, SUM(t.docs) AS docs, a.docs AS df
+            FROM feedback_terms t
+            JOIN feedback_term_totals a
+              ON a.restaurant_id = t.restaurant_id AND a.term = t.term
+            WHERE t.restaurant_id=? AND t.day BETWEEN ? AND ?
+            GROUP BY t.term
+        """, (restaurant_id, days_back(until, days), until)).fetchall()
+
+    total = comment_count(db, restaurant_id)
+    comments = 0
+    keywords = []
+    for term, docs, df in rows:
+        if term == ALL:
+            comments = docs
+            continue
+        idf = math.log((1 + total) / (1 + df)) + 1
+        keywords.append({"term": term, "comments": docs, "score": round(docs * idf, 3)})
+
+    keywords.sort(key=lambda k: (-k["score"], k["term"]))
+    return {"period": period, "until": until, "comments": comments, "keywords": keywords[:limit]}
+
+
+def trending_complaints(db, restaurant_id, until, limit=TOP_KEYWORDS):
+    # Terms making up a bigger share of negative comments in the recent
+    # window than in the baseline before it, biggest rise first.
+    start = days_back(until, TREND_DAYS)
+    baseline_start = days_back(until, TREND_DAYS + TREND_BASELINE_DAYS)
+    rows = db.execute("""
+        SELECT term,
+               SUM(CASE WHEN day >= ? THEN docs ELSE 0 END) AS recent_docs,
+               SUM(CASE WHEN day < ? THEN docs ELSE 0 END) AS baseline_docs,
+               SUM(CASE WHEN day >= ? THEN negative_docs ELSE 0 END) AS recent,
+               SUM(CASE WHEN day < ? THEN negative_docs ELSE 0 END) AS baseline
+        FROM feedback_terms
+        WHERE restaurant_id=? AND day BETWEEN ? AND ?
+        GROUP BY term
+        HAVING term = ? OR recent >= ?
+    """, (start, start, start, start, restaurant_id, baseline_start, until,
+          ALL, TREND_MIN_COMMENTS)).fetchall()
+
+    comments = {"recent": 0, "baseline": 0}
+    for r in rows:
+        if r["term"] == ALL:
+            comments = {"recent": r["recent_docs"], "baseline": r["baseline_docs"]}
+
+    complaints = []
+    for r in rows:
+        if r["term"] == ALL:
+            continue
+        # +1/+2 keeps a term never seen in a quiet baseline from scoring infinity
+        share = (r["recent"] + 1) / (comments["recent"] + 2)
+        baseline_share = (r["baseline"] + 1) / (comments["baseline"] + 2)
+        if share <= baseline_share:
+            continue
+        complaints.append({
+            "term": r["term"],
+            "comments": r["recent"],
+            "share": round(r["recent"] / comments["recent"], 3),
+            "baseline_share": round(r["baseline"] / comments["baseline"], 3) if comments["baseline"] else 0.0,
+            "lift": round(share / baseline_share, 2),
+        })
+
+    complaints.sort(key=lambda c: (-c["lift"], -c["comments"], c["term"]))
+    return {
+        "window_days": TREND_DAYS,
+        "baseline_days": TREND_BASELINE_DAYS,
+        "until": until,
+        "comments": comments,
+        "complaints": complaints[:limit],
+    }
+
+
+# ---------------- CACHE ----------------
+# Written only by the feedback worker; dashboards just read it.
+def cached(db, restaurant_id, period, until):
+    # The stored result, if still current: same comment count, same day
+    row = db.execute("""
+        SELECT result FROM keyword_cache
+        WHERE restaurant_id=? AND period=? AND until=? AND docs=?
+    """, (restaurant_id, period, until, comment_count(db, restaurant_id))).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def store(db, restaurant_id, period, until, result):
+    # In the caller's transaction
+    db.execute("""
+        INSERT OR REPLACE INTO keyword_cache (restaurant_id, period, until, docs, result)
+        VALUES (?, ?, ?, ?, ?)
+    """, (restaurant_id, period, until, comment_count(db, restaurant_id), json.dumps(result)))
+
+
+def keywords(db, restaurant_id, period="7d", until=None):
+    # Read-only: on a miss (the worker has not caught up with a new day
+    # yet) the bounded computation runs without storing anything.
+    until = until or today()
+    return cached(db, restaurant_id, period, until) or \
+        top_keywords(db, restaurant_id, period, until)
+
+
+def trending(db, restaurant_id, until=None):
+    until = until or today()
+    return cached(db, restaurant_id, "trending", until) or \
+        trending_complaints(db, restaurant_id, until)
+
+
+def refresh(db, restaurant_ids, until=None):
+    # Recomputes and stores every period for these restaurants. Called by
+    # the worker after a batch, and for a new day.
+    until = until or today()
+    for restaurant_id in restaurant_ids:
+        for period in PERIODS:
+            store(db, restaurant_id, period, until, top_keywords(db, restaurant_id, period, until))
+        store(db, restaurant_id, "trending", until, trending_complaints(db, restaurant_id, until))
+
+
+def outdated(db, until=None):
+    # Restaurants whose stored results are from an earlier day
+    return [r[0] for r in db.execute(
+        "SELECT DISTINCT restaurant_id FROM keyword_cache WHERE until <> ?",
+        (until or today(),)
+    )]
@@ -0,0 +1,28 @@
+import threading
+from collections import OrderedDict
+
+
+# ---------------- LRU CACHE ----------------
+class LRUCache:
+    # The `size` most recently used entries, safe to share between a
+    # worker's threads. Each process has its own copy.
+
+    def __init__(self, size):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return value
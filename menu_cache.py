@@ -0,0 +1,80 @@
+import os
+
+from lru import LRUCache
+
+# Restaurants whose menus are kept in memory per process. Each entry is a
+# few KB to a few hundred KB, so this bounds the cache at roughly tens of
+# MB even for very large menus.
+MAX_RESTAURANTS = int(os.environ.get("MENU_CACHE_SIZE", 256))
+
+
+# ---------------- VERSIONING ----------------
+def bump_version(db, restaurant_id):
+    # Call in the same transaction as any change that alters what the
+    # customer page shows (menu rows, restaurant name). Other gunicorn
+    # workers see the new version on their next lookup.
+    db.execute("""
+        UPDATE restaurants
+        SET menu_version = menu_version + 1
+        WHERE id=?
+    """, (restaurant_id,))
+
+
+def etag_for(restaurant):
+    return f'menu-{restaurant["id"]}-{restaurant["menu_version"]}'
+
+
+# ---------------- LRU CACHE ----------------
+class MenuCache:
+    def __init__(self, max_restaurants=MAX_RESTAURANTS):
+        self._entries = LRUCache(max_restaurants)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, restaurant_id, version):
+        entry = self._entries.get(restaurant_id)
+        if entry is None or entry["version"] != version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, restaurant_id, version, **data):
+        return self._entries.put(restaurant_id, dict(data, version=version))
+
+    def menu(self, db, restaurant_id, version):
+        # Available items for the customer page, read at most once per
+        # menu version per process.
+        entry = self.get(restaurant_id, version)
+        if entry is None:
+            rows = db.execute(
+                "SELECT * FROM menu WHERE restaurant_id=? AND available=1 ORDER BY id",
+                (restaurant_id,)
+            ).fetchall()
+            entry = self.put(restaurant_id, version, menu=[dict(m) for m in rows])
+        return entry
+
+
+def partition(entry):
+    # Categories in menu order with their items, computed once per cached
+    # menu version.
+    if "by_category" not in entry:
+        by_category = {}
+        for item in entry["menu"]:
+            by_category.setdefault(item["category"] or "", []).append(item)
+        entry["by_category"] = by_category
+        entry["categories"] = [
+            {"name": name, "count": len(items)}
+            for name, items in by_category.items()
+        ]
+    return entry["categories"], entry["by_category"]
+
+
+def by_id(entry):
+    # id -> available item, for pricing orders against the cached menu
+    if "by_id" not in entry:
+        entry["by_id"] = {item["id"]: item for item in entry["menu"]}
+    return entry["by_id"]
+
+
+menu_cache = MenuCache()
@@ -0,0 +1,178 @@
+import csv
+import io
+import json
+import math
+
+# Largest menu one request may import
+MAX_ROWS = 5000
+MAX_NAME = 120
+
+TRUE_VALUES = {"1", "true", "yes", "y"}
+FALSE_VALUES = {"0", "false", "no", "n"}
+
+
+# ---------------- PARSING ----------------
+def csv_rows(stream):
+    # (row number, dict) straight off the upload; row 1 is the header.
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    for row in reader:
+        yield reader.line_num, {
+            (k or "").strip().lower(): v for k, v in row.items()
+        }
+
+
+def json_rows(data):
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise ValueError("expected a list of items")
+    for n, row in enumerate(data, start=1):
+        yield n, row if isinstance(row, dict) else {}
+
+
+def rows_from_request(request):
+    # A multipart "file" (.csv or .json), a text/csv body or a JSON body
+    upload = request.files.get("file")
+    if upload:
+        if upload.filename.lower().endswith(".json"):
+            return json_rows(json.load(upload.stream))
+        return csv_rows(upload.stream)
+
+    if request.mimetype == "text/csv":
+        return csv_rows(request.stream)
+
+    return json_rows(request.get_json(silent=True))
+
+
+# ---------------- VALIDATION ----------------
+def _available(value):
+    if value is None or value == "":
+        return 1
+    if isinstance(value, bool):
+        return int(value)
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return 1
+    if text in FALSE_VALUES:
+        return 0
+    raise ValueError(f"available must be yes/no, got {value!r}")
+
+
+def clean(row):
+    name = str(row.get("name") or "").strip()
+    if not name:
+        raise ValueError("name is required")
+    if len(name) > MAX_NAME:
+        raise ValueError(f"name longer than {MAX_NAME} characters")
+
+    try:
+        price = round(float(row.get("price")), 2)
+    except (TypeError, ValueError):
+        raise ValueError(f"price must be a number, got {row.get('price')!r}")
+    # float() accepts "nan" and "inf"; neither is a price
+    if not math.isfinite(price):
+        raise ValueError(f"price must be a number, got {row.get('price')!r}")
+    if price < 0:
+        raise ValueError("price cannot be negative")
+
+    image = str(row.get("image") or row.get("image_url") or "").strip()
+    if image and not image.startswith(("http://", "https://")):
+        raise ValueError("image must be an http(s) URL")
+
+    return {
+        "name": name,
+        "price": price,
+        "category": str(row.get("category") or "").strip() or None,
+        "available": _available(row.get("available")),
+        "image": image,
+    }
+
+
+def validate(rows):
+    # One pass: returns (clean items, per-row errors). A name repeated in
+    # the same file is an error rather than a silent overwrite.
+    items, errors, seen = [], [], {}
+
+    for n, row in rows:
+        if len(items) + len(errors) >= MAX_ROWS:
+            errors.append({"row": n, "error": f"more than {MAX_ROWS} rows; rest ignored"})
+            break
+        try:
+            item = clean(row)
+        except ValueError as e:
+            errors.append({"row": n, "error": str(e)})
+            continue
+
+        key = item["name"].casefold()
+        if key in seen:
+            errors.append({"row": n, "error": f"duplicate of row {seen[key]}"})
+            continue
+        seen[key] = n
+        items.append(item)
+
+    return items, errors
+
+
+# ---------------- UPSERT ----------------
+def upsert(db, restaurant_id, items, update_existing=True):
+    # Matches on the item name (case-insensitive) within the restaurant.
+    # Existing rows are looked up once, then updated and inserted with one
+    # executemany each. Runs in the caller's transaction.
+    existing = {}
+    for item_id, name in db.execute(
+        "SELECT id, name FROM menu WHERE restaurant_id=? ORDER BY id",
+        (restaurant_id,)
+    ):
+        existing.setdefault(name.strip().casefold(), item_id)
+
+    updates, inserts = [], []
+    for item in items:
+        params = dict(
+            item,
+            restaurant_id=restaurant_id,
+            image_thumb=item.get("image_thumb"),
+            image_medium=item.get("image_medium"),
+            id=existing.get(item["name"].casefold())
+        )
+        if params["id"] is None:
+            inserts.append(params)
+        elif update_existing:
+            updates.append(params)
+
+    # An empty image keeps the current one; a different image drops the
+    # old resized variants.
+    db.executemany("""
+        UPDATE menu
+        SET name=:name, price=:price, category=:category, available=:available,
+            image = CASE WHEN :image = '' THEN image ELSE :image END,
+            image_thumb = CASE WHEN :image = '' OR :image = image
+                               THEN image_thumb ELSE :image_thumb END,
+            image_medium = CASE WHEN :image = '' OR :image = image
+                                THEN image_medium ELSE :image_medium END
+        WHERE id=:id
+    """, updates)
+
+    db.executemany("""
+        INSERT INTO menu
+        (restaurant_id, name, price, category, image, image_thumb, image_medium, available)
+        VALUES (:restaurant_id, :name, :price, :category, :image,
+                :image_thumb, :image_medium, :available)
+    """, inserts)
+
+    return {"inserted": len(inserts), "updated": len(updates)}
+
+
+def source_items(db, restaurant_id):
+    rows = db.execute("""
+        SELECT name, price, category, available, image, image_thumb, image_medium
+        FROM menu WHERE restaurant_id=?
+        ORDER BY id
+    """, (restaurant_id,)).fetchall()
+
+    items, seen = [], set()
+    for r in rows:
+        key = r["name"].strip().casefold()
+        if key not in seen:
+            seen.add(key)
+            items.append(dict(r, name=r["name"].strip(), image=r["image"] or ""))
+    return items
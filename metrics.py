@@ -0,0 +1,434 @@
+import bisect
+import hmac
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+from flask import g, request, session
+
+import slow_queries
+from workers import ensure_thread
+
+# METRICS=1 turns on request, SQL and stream instrumentation, served in
+# Prometheus text format at /metrics. Off, every hook below returns at
+# once and connections are plain sqlite3 ones (unless the slow query log
+# needs the statement timings).
+ENABLED = os.environ.get("METRICS", "0") == "1"
+# Scrapers send "Authorization: Bearer <token>"; a logged-in superadmin
+# can also read the page.
+TOKEN = os.environ.get("METRICS_TOKEN")
+# Each worker process writes its numbers here and /metrics adds them up,
+# whichever worker answers the scrape. The default is per gunicorn master.
+METRICS_DIR = os.environ.get("METRICS_DIR") or os.path.join(
+    tempfile.gettempdir(), f"restaurant-metrics-{os.getppid()}"
+)
+FLUSH_INTERVAL = 5
+
+# Seconds
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+METRICS = {
+    # name -> (type, help, histogram buckets)
+    "http_request_duration_seconds": (
+        "histogram", "Time to build the response (first byte for streams).", REQUEST_BUCKETS),
+    "http_requests_total": ("counter", "Requests answered.", None),
+    "sqlite_query_duration_seconds": (
+        "histogram", "Statement run time in execute(), up to its first row.", QUERY_BUCKETS),
+    "sqlite_fetch_seconds_total": ("counter", "Time spent reading rows after execute().", None),
+    "sqlite_query_rows_total": ("counter", "Rows returned by statements.", None),
+    "sqlite_write_lock_seconds": (
+        "histogram", "Time to take the write lock: BEGIN IMMEDIATE, or the first "
+        "write of a transaction (its own run time included).", QUERY_BUCKETS),
+    "sqlite_commit_duration_seconds": ("histogram", "Time spent in COMMIT.", QUERY_BUCKETS),
+    "sqlite_busy_errors_total": ("counter", "Statements that gave up on a locked database.", None),
+    "sse_connections": ("gauge", "Open /events streams.", None),
+    "sse_bytes_total": ("counter", "Bytes sent on /events streams.", None),
+    "db_pool_connections": ("gauge", "Pooled SQLite connections of the central database.", None),
+}
+
+
+# ---------------- REGISTRY ----------------
+class Registry:
+    # Numbers for this process. Keys are (name, labels), labels being a
+    # tuple of (label, value) pairs.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.values = {}
+        self.histograms = {}
+        self._collectors = []
+        self._flusher = None
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Forked: the parent's numbers are already counted by the parent
+            self._pid = os.getpid()
+            self.values, self.histograms, self._flusher = {}, {}, None
+
+    def inc(self, name, labels=(), amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=()):
+        if not ENABLED:
+            return
+        buckets = METRICS[name][2]
+        with self._lock:
+            self._check_fork()
+            key = (name, labels)
+            h = self.histograms.get(key)
+            if h is None:
+                # per-bucket counts (not cumulative), then +Inf, sum
+                h = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            h[bisect.bisect_left(buckets, seconds)] += 1
+            h[-1] += seconds
+
+    def add_collector(self, fn):
+        # fn() -> [(name, labels, value)] of gauges read at flush time
+        self._collectors.append(fn)
+
+    def snapshot(self):
+        with self._lock:
+            self._check_fork()
+            values = [[n, list(map(list, l)), v] for (n, l), v in self.values.items()]
+            histograms = [[n, list(map(list, l)), list(h)] for (n, l), h in self.histograms.items()]
+        for fn in self._collectors:
+            values += [[n, list(map(list, l)), v] for n, l, v in fn()]
+        return {"pid": os.getpid(), "values": values, "histograms": histograms}
+
+    def flush(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def ensure_flusher(self):
+        with self._lock:
+            self._check_fork()
+            self._flusher = ensure_thread(self._flusher, self._flush_forever, "metrics-flush")
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                continue
+
+
+registry = Registry()
+
+
+# ---------------- SQL ----------------
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WRITES = ("INSERT", "UPDATE", "DELETE", "REPLACE", "BEGIN IMMEDIATE", "BEGIN EXCLUSIVE")
+# Statement kinds that get metrics; schema changes and PRAGMAs do not
+_VERBS = ("select", "insert", "update", "delete", "replace", "with",
+          "begin", "commit", "rollback", "savepoint", "release")
+_TABLE = re.compile(
+    r"\b(?:FROM|INTO|UPDATE(?:\s+OR\s+\w+)?)\s+(?:\w+\.)?(\w+)", re.IGNORECASE
+)
+_normalized = {}
+_statements = {}
+
+
+def normalize(sql):
+    # One label per statement in the code: literals become ?, IN (?, ?, ...)
+    # lists become IN (?), whitespace single spaces.
+    text = _normalized.get(sql)
+    if text is None:
+        text = " ".join(sql.split())
+        text = _IN_LISTS.sub("IN (?)", _LITERALS.sub("?", text))
+        if len(_normalized) < 4096:
+            _normalized[sql] = text
+    return text
+
+
+def statement_labels(sql):
+    # Short, bounded labels: the verb and the first table it touches, e.g.
+    # (("verb", "select"), ("table", "orders")). None for statements
+    # that are not tracked.
+    if sql in _statements:
+        return _statements[sql]
+    words = sql.split(None, 1)
+    verb = words[0].lower() if words else ""
+    if verb not in _VERBS:
+        labels = None
+    else:
+        if verb == "with":
+            verb = "select"
+        table = _TABLE.search(sql)
+        labels = (("verb", verb), ("table", table.group(1).lower() if table else ""))
+    if len(_statements) < 4096:
+        _statements[sql] = labels
+    return labels
+
+
+_next_row = sqlite3.Cursor.__next__
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    # Each execute() is timed as it returns. Rows and the time spent
+    # reading them are added once the rows are consumed (or at the next
+    # execute() or close()); the slow query log gets execute plus fetch.
+    _sql = None
+
+    def _start(self, sql, params, many):
+        self._finish()
+        self._sql = sql
+        self._params = params
+        self._many = many
+        self._rows = 0
+        self._elapsed = self._executed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            labels = statement_labels(self._sql)
+            if labels is not None and self._elapsed > self._executed:
+                registry.inc("sqlite_fetch_seconds_total", labels, self._elapsed - self._executed)
+            if labels is not None and self._rows:
+                registry.inc("sqlite_query_rows_total", labels, self._rows)
+            if slow_queries.ENABLED and self._elapsed * 1000 >= slow_queries.THRESHOLD_MS:
+                slow_queries.record(
+                    self.connection, self._sql, normalize(self._sql), self._params,
+                    self._elapsed, self._many
+                )
+            self._sql = self._params = None
+
+    def _run(self, method, sql, params, many=False):
+        self._start(sql, params, many)
+        lock = not self.connection.in_transaction and sql.lstrip()[:15].upper().startswith(_WRITES)
+        began = time.perf_counter()
+        try:
+            method(sql, params)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                registry.inc("sqlite_busy_errors_total")
+            raise
+        finally:
+            elapsed = time.perf_counter() - began
+            self._elapsed = self._executed = elapsed
+            labels = statement_labels(sql)
+            if labels is not None:
+                registry.observe("sqlite_query_duration_seconds", elapsed, labels)
+            if lock:
+                registry.observe("sqlite_write_lock_seconds", elapsed)
+        if self.description is None:
+            self._finish()
+        return self
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params)
+
+    def executemany(self, sql, seq):
+        # Materialized so the slow query log can show the first row
+        seq = seq if isinstance(seq, (list, tuple)) or not slow_queries.ENABLED else list(seq)
+        return self._run(super().executemany, sql, seq, many=True)
+
+    def _fetched(self, began, rows, done):
+        self._elapsed += time.perf_counter() - began
+        self._rows += rows
+        if done:
+            self._finish()
+
+    def fetchone(self):
+        began = time.perf_counter()
+        row = super().fetchone()
+        # Callers rarely read on after fetchone(), so the statement ends here
+        self._fetched(began, row is not None, True)
+        return row
+
+    def fetchmany(self, size=None):
+        began = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(began, len(rows), not rows)
+        return rows
+
+    def fetchall(self):
+        began = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(began, len(rows), True)
+        return rows
+
+    def __next__(self):
+        # Per row, so kept to the bare minimum
+        began = time.perf_counter()
+        try:
+            row = _next_row(self)
+        except StopIteration:
+            self._fetched(began, 0, True)
+            raise
+        self._elapsed += time.perf_counter() - began
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq):
+        return self.cursor().executemany(sql, seq)
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        began = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                registry.inc("sqlite_busy_errors_total")
+            raise
+        finally:
+            registry.observe("sqlite_commit_duration_seconds", time.perf_counter() - began)
+
+
+def connection_factory():
+    if ENABLED or slow_queries.ENABLED:
+        return InstrumentedConnection
+    return sqlite3.Connection
+
+
+# ---------------- REQUESTS ----------------
+def _before_request():
+    registry.ensure_flusher()
+    g.metrics_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        registry.observe(
+            "http_request_duration_seconds", time.perf_counter() - started,
+            (("endpoint", endpoint), ("method", request.method))
+        )
+        registry.inc("http_requests_total", (
+            ("endpoint", endpoint), ("method", request.method),
+            ("status", str(response.status_code))
+        ))
+    return response
+
+
+def instrument(app):
+    if ENABLED:
+        app.before_request(_before_request)
+        app.after_request(_after_request)
+
+
+# ---------------- STREAMS ----------------
+def stream_opened(restaurant_id):
+    if ENABLED:
+        registry.inc("sse_connections", (("restaurant", str(restaurant_id)),))
+
+
+def stream_closed(restaurant_id):
+    if ENABLED:
+        registry.inc("sse_connections", (("restaurant", str(restaurant_id)),), -1)
+
+
+def stream_sent(restaurant_id, size):
+    if ENABLED:
+        registry.inc("sse_bytes_total", (("restaurant", str(restaurant_id)),), size)
+
+
+# ---------------- EXPOSITION ----------------
+def authorized():
+    header = request.headers.get("Authorization", "")
+    if TOKEN and hmac.compare_digest(header, f"Bearer {TOKEN}"):
+        return True
+    return session.get("role") == "superadmin"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge():
+    # Counters and histograms of every worker that ever ran under this
+    # master are added up; gauges only for workers still running.
+    registry.flush()
+    values, histograms = {}, {}
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _alive(snap["pid"])
+
+        for metric, labels, value in snap["values"]:
+            if METRICS[metric][0] == "gauge" and not alive:
+                continue
+            key = (metric, tuple(map(tuple, labels)))
+            values[key] = values.get(key, 0) + value
+        for metric, labels, h in snap["histograms"]:
+            key = (metric, tuple(map(tuple, labels)))
+            if key in histograms:
+                histograms[key] = [a + b for a, b in zip(histograms[key], h)]
+            else:
+                histograms[key] = h
+    return values, histograms
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    values, histograms = _merge()
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind != "histogram":
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{_labels(labels)} {value}")
+            continue
+
+        for (metric, labels), h in sorted(histograms.items()):
+            if metric != name:
+                continue
+            running = 0
+            for le, count in zip(buckets + ("+Inf",), h[:-1]):
+                running += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', le)])} {running}")
+            lines.append(f"{name}_sum{_labels(labels)} {h[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {running}")
+    return "\n".join(lines) + "\n"
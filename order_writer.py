@@ -0,0 +1,147 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import shards
+import stats
+from db import connect
+from realtime import hub, touch
+from workers import ensure_thread
+
+# ORDER_GROUP_COMMIT=1 funnels /order writes in each worker process
+# through one writer that commits them in batches: one transaction (and
+# one WAL sync) for every order that arrived while the last batch was
+# being written, instead of one per request all fighting for the lock.
+GROUP_COMMIT = os.environ.get("ORDER_GROUP_COMMIT", "0") == "1"
+# How long the writer waits for more orders after the first one arrives
+WINDOW = float(os.environ.get("ORDER_GROUP_WINDOW_MS", 2)) / 1000
+MAX_BATCH = int(os.environ.get("ORDER_GROUP_MAX_BATCH", 256))
+# How long an order may wait in the queue before the request gives up
+SUBMIT_TIMEOUT = 15
+
+
+# ---------------- WRITE ----------------
+def insert_order(db, restaurant_id, table, items, feedback_token=None):
+    # Order, its lines and the rollups, in the caller's transaction
+    total = sum(i["price"] * i["qty"] for i in items)
+
+    order_id = db.execute("""
+        INSERT INTO orders
+        (restaurant_id, table_no, total, status, feedback_token, created_at)
+        VALUES (?,?,?,?,?,CURRENT_TIMESTAMP)
+    """, (restaurant_id, table, total, "Received", feedback_token)).lastrowid
+
+    db.executemany("""
+        INSERT INTO order_items
+        (order_id, restaurant_id, menu_id, name, price, qty, created_at)
+        SELECT ?, ?, ?, ?, ?, ?, created_at FROM orders WHERE id=?
+    """, [
+        (order_id, restaurant_id, i.get("id"),
+         i["name"], i["price"], i["qty"], order_id)
+        for i in items
+    ])
+    stats.order_placed(db, order_id, total)
+    touch(db, restaurant_id)
+
+    return order_id
+
+
+# ---------------- GROUP COMMIT ----------------
+class GroupCommitWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.orders = 0
+
+    def submit(self, restaurant_id, table, items, feedback_token=None):
+        # Blocks until the batch holding this order has committed, then
+        # returns the order id (or raises what the write raised).
+        # TimeoutError means the order was taken back out of the queue
+        # unwritten, so the client can safely retry. Once the writer has
+        # started on it, the outcome is always waited for: giving up then
+        # could report a failure for an order that still commits.
+        future = Future()
+        self._ensure_thread()
+        self._queue.put((future, restaurant_id, table, items, feedback_token))
+        try:
+            return future.result(timeout=SUBMIT_TIMEOUT)
+        except TimeoutError:
+            if future.cancel():
+                raise
+        return future.result()
+
+    def _ensure_thread(self):
+        with self._lock:
+            self._thread = ensure_thread(self._thread, self._run, "order-writer")
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # With sharding on, a batch is split into one transaction per shard.
+        conns = {}
+
+        while True:
+            groups = {}
+            for entry in self._next_batch():
+                groups.setdefault(shards.shard_path(entry[1]), []).append(entry)
+            for path, batch in groups.items():
+                if path not in conns:
+                    conns[path] = connect(path)
+                self._write(conns[path], batch)
+
+    def _write(self, conn, batch):
+        # Each order gets a savepoint, so one bad order fails alone while
+        # the rest of the batch still commits.
+        # Orders whose request gave up are skipped; the rest can no longer
+        # be cancelled.
+        batch = [entry for entry in batch if entry[0].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        done = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, restaurant_id, table, items, token in batch:
+                conn.execute("SAVEPOINT order_write")
+                try:
+                    order_id = insert_order(conn, restaurant_id, table, items, token)
+                except (sqlite3.IntegrityError, KeyError, TypeError, ValueError) as e:
+                    conn.execute("ROLLBACK TO order_write")
+                    conn.execute("RELEASE order_write")
+                    future.set_exception(e)
+                    continue
+                conn.execute("RELEASE order_write")
+                done.append((future, restaurant_id, order_id))
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            for future, *_ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.orders += len(done)
+        for future, _, order_id in done:
+            future.set_result(order_id)
+        for restaurant_id in {rid for _, rid, _ in done}:
+            hub.notify(restaurant_id)
+
+
+writer = GroupCommitWriter()
@@ -0,0 +1,186 @@
+import os
+import socket
+from ipaddress import ip_address, ip_network
+from urllib.parse import urlparse
+
+import escpos
+
+# Most jobs a single request may queue
+MAX_BATCH = 200
+# Tries before a job is left as failed
+MAX_ATTEMPTS = 8
+SOCKET_TIMEOUT = 5
+# A failed job waits RETRY_BASE_SECONDS, doubling with each attempt up to
+# RETRY_MAX_SECONDS, so an offline printer is not retried on every pass.
+# With the defaults a job is given up on after about ten minutes.
+RETRY_BASE_SECONDS = 5
+RETRY_MAX_SECONDS = 300
+
+# tcp:// printers must resolve to addresses in PRINTER_NETWORKS and use one
+# of PRINTER_PORTS (raw printing ports by default). Otherwise a restaurant
+# admin could make the server connect to anything it can reach, internal
+# services included. Loopback is deliberately not in the default list.
+PRINTER_NETWORKS = [
+    ip_network(n.strip()) for n in
+    os.environ.get("PRINTER_NETWORKS", "10.0.0.0/8,172.16.0.0/12,192.168.0.0/16").split(",")
+    if n.strip()
+]
+PRINTER_PORTS = {
+    int(p) for p in os.environ.get("PRINTER_PORTS", "9100,9101,9102").split(",")
+    if p.strip()
+}
+
+# file:// targets must live under this directory (a spool dir, or one
+# holding device symlinks). Unset, only tcp:// printers are accepted, so a
+# restaurant admin cannot make the server write arbitrary files.
+SPOOL_DIR = os.environ.get("PRINT_SPOOL_DIR")
+
+
+# ---------------- REQUEST SIDE ----------------
+def load_receipts(db, restaurant_id, order_ids):
+    # order id -> ESC/POS bytes for the restaurant's own orders, in two
+    # queries however many bills are asked for.
+    marks = ",".join("?" * len(order_ids))
+
+    orders = db.execute(f"""
+        SELECT o.id, o.table_no, o.created_at, r.name, r.gstin, r.address, r.phone
+        FROM orders o
+        JOIN restaurants r ON r.id = o.restaurant_id
+        WHERE o.restaurant_id=? AND o.id IN ({marks})
+    """, (restaurant_id, *order_ids)).fetchall()
+
+    lines = {}
+    for row in db.execute(f"""
+        SELECT order_id, name, price, qty
+        FROM order_items
+        WHERE restaurant_id=? AND order_id IN ({marks})
+        ORDER BY id
+    """, (restaurant_id, *order_ids)):
+        lines.setdefault(row["order_id"], []).append(row)
+
+    return {
+        o["id"]: escpos.render(escpos.receipt(o, lines.get(o["id"], [])))
+        for o in orders
+    }
+
+
+def enqueue(db, restaurant_id, target, receipts):
+    # One job per bill, all sharing the restaurant's printer target
+    db.executemany("""
+        INSERT INTO print_jobs (restaurant_id, order_id, target, payload)
+        VALUES (?, ?, ?, ?)
+    """, [
+        (restaurant_id, order_id, target, payload)
+        for order_id, payload in receipts.items()
+    ])
+
+
+# ---------------- TRANSPORTS ----------------
+def _in_spool(path):
+    if not SPOOL_DIR or not path:
+        return False
+    spool = os.path.realpath(SPOOL_DIR)
+    return os.path.commonpath([spool, os.path.realpath(path)]) == spool
+
+
+def _on_printer_network(address):
+    address = ip_address(address.split("%")[0])
+    return any(address in network for network in PRINTER_NETWORKS)
+
+
+def _printer_address(parsed):
+    # (ip, port) to connect to, or None unless every address the host
+    # resolves to is allowed. Callers connect to the ip returned, so the
+    # name cannot resolve somewhere else between the check and the connect.
+    try:
+        port = parsed.port or 9100
+    except ValueError:
+        return None
+    if not parsed.hostname or port not in PRINTER_PORTS:
+        return None
+    try:
+        found = socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+    except OSError:
+        return None
+    addresses = [info[4][0] for info in found]
+    if not addresses or not all(_on_printer_network(a) for a in addresses):
+        return None
+    return addresses[0], port
+
+
+def valid_target(target):
+    parsed = urlparse(target or "")
+    if parsed.scheme == "tcp":
+        return _printer_address(parsed) is not None
+    return parsed.scheme == "file" and _in_spool(parsed.path)
+
+
+def send(target, payload):
+    # tcp://host:9100 for network printers (raw port 9100), or a file
+    # under PRINT_SPOOL_DIR (a device link, or a plain file when testing)
+    parsed = urlparse(target)
+
+    if parsed.scheme == "tcp":
+        # Checked again here: targets saved before the rules changed, or
+        # names whose DNS has moved since, are refused too.
+        address = _printer_address(parsed)
+        if address is None:
+            raise ValueError(f"printer {parsed.netloc!r} is not on an allowed network and port")
+        with socket.create_connection(address, timeout=SOCKET_TIMEOUT) as conn:
+            conn.sendall(payload)
+    elif parsed.scheme == "file" and _in_spool(parsed.path):
+        with open(parsed.path, "ab") as f:
+            f.write(payload)
+    else:
+        raise ValueError(f"unsupported printer target {target!r}")
+
+
+# ---------------- WORKER SIDE ----------------
+def retry_delay(attempts):
+    # Seconds to wait after a failure, for a job already tried `attempts` times
+    return min(RETRY_BASE_SECONDS * 2 ** attempts, RETRY_MAX_SECONDS)
+
+
+def process_pending(db, limit=100):
+    # Sends queued jobs that are due, one connection per printer for the
+    # whole batch. Returns how many jobs were printed.
+    jobs = db.execute("""
+        SELECT id, target, payload, attempts FROM print_jobs
+        WHERE status='pending'
+          AND (next_attempt_at IS NULL OR next_attempt_at <= CURRENT_TIMESTAMP)
+        ORDER BY id
+        LIMIT ?
+    """, (limit,)).fetchall()
+
+    by_target = {}
+    for job_id, target, payload, attempts in jobs:
+        by_target.setdefault(target, []).append((job_id, payload, attempts))
+
+    printed = 0
+    for target, batch in by_target.items():
+        ids = [(job_id,) for job_id, _, _ in batch]
+        try:
+            send(target, b"".join(payload for _, payload, _ in batch))
+        except (OSError, ValueError) as e:
+            db.executemany(f"""
+                UPDATE print_jobs
+                SET attempts = attempts + 1,
+                    error = ?,
+                    next_attempt_at = datetime('now', ?),
+                    status = CASE WHEN attempts + 1 >= {MAX_ATTEMPTS}
+                                  THEN 'failed' ELSE 'pending' END
+                WHERE id=?
+            """, [
+                (str(e)[:200], f"+{retry_delay(attempts)} seconds", job_id)
+                for job_id, _, attempts in batch
+            ])
+        else:
+            db.executemany("""
+                UPDATE print_jobs
+                SET status='done', printed_at=CURRENT_TIMESTAMP
+                WHERE id=?
+            """, ids)
+            printed += len(ids)
+        db.commit()
+
+    return printed
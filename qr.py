@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+from urllib.parse import quote
+from zipfile import ZipFile, ZIP_STORED
+
+import qrcode
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+from workers import pool_map
+
+QR_FOLDER = "static/qr"
+# Rendered PNGs keyed by the hash of the encoded URL, so the same
+# subdomain + table + base URL is only ever rendered once.
+CACHE_FOLDER = os.path.join(QR_FOLDER, "cache")
+# Most PNGs kept there. A hit refreshes the file's mtime and the least
+# recently used go once the cap is passed, so codes for old base URLs,
+# subdomains and table counts do not pile up. Above app.MAX_TABLES, so one
+# full batch never evicts itself.
+CACHE_MAX_FILES = int(os.environ.get("QR_CACHE_FILES", 2000))
+
+# Below this many missing codes the pool start-up costs more than it saves
+POOL_THRESHOLD = 16
+
+
+def customer_url(base_url, subdomain, table):
+    return f"{base_url.rstrip('/')}/customer/{quote(subdomain)}?table={table}"
+
+
+def cache_path(url):
+    return os.path.join(CACHE_FOLDER, hashlib.sha256(url.encode()).hexdigest() + ".png")
+
+
+# ---------------- RENDERING ----------------
+def render_png(url):
+    buf = io.BytesIO()
+    qrcode.make(url).save(buf)
+    return buf.getvalue()
+
+
+def render_matrix(url):
+    # Module grid without the quiet zone; the sheet layout leaves its own
+    # margin around each code.
+    code = qrcode.QRCode(border=0)
+    code.add_data(url)
+    code.make(fit=True)
+    return code.get_matrix()
+
+
+def render_many(urls):
+    # url -> PNG bytes, reading cached codes from disk and rendering the
+    # rest across the process pool.
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+
+    pngs, missing = {}, []
+    for url in urls:
+        path = cache_path(url)
+        try:
+            os.utime(path)
+            with open(path, "rb") as f:
+                pngs[url] = f.read()
+        except FileNotFoundError:
+            missing.append(url)
+
+    for url, png in zip(missing, pool_map(render_png, missing, POOL_THRESHOLD)):
+        path = cache_path(url)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
+        pngs[url] = png
+
+    if missing:
+        evict()
+    return pngs
+
+
+def evict(keep=CACHE_MAX_FILES):
+    # Removes the least recently used PNGs beyond `keep`. Other workers may
+    # be pruning at the same time, so files already gone are skipped.
+    cached = []
+    with os.scandir(CACHE_FOLDER) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".png"):
+                continue
+            try:
+                cached.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                pass
+
+    cached.sort(reverse=True)
+    for _, path in cached[keep:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# ---------------- OUTPUT ----------------
+def table_zip(base_url, subdomain, count):
+    # In-memory zip of table_1.png .. table_<count>.png. PNGs are already
+    # compressed, so they are stored rather than deflated again.
+    urls = [customer_url(base_url, subdomain, t) for t in range(1, count + 1)]
+    pngs = render_many(urls)
+
+    buf = io.BytesIO()
+    with ZipFile(buf, "w", ZIP_STORED) as zipf:
+        for t, url in enumerate(urls, start=1):
+            zipf.writestr(f"table_{t}.png", pngs[url])
+    buf.seek(0)
+    return buf
+
+
+# A4, 3 x 4 codes per page: each cell is ~70 x 74 mm, which keeps the
+# code itself around 50 mm wide for scanning from across a table.
+SHEET_COLUMNS = 3
+SHEET_ROWS = 4
+SHEET_MARGIN = 10 * mm
+QR_SIZE = 50 * mm
+
+
+def _draw_matrix(c, matrix, x, y, size):
+    # One path per code, one rectangle per horizontal run of dark modules,
+    # instead of an image or a rectangle per module.
+    n = len(matrix)
+    module = size / n
+    path = c.beginPath()
+    for row, cells in enumerate(matrix):
+        top = y + size - (row + 1) * module
+        col = 0
+        while col < n:
+            if not cells[col]:
+                col += 1
+                continue
+            start = col
+            while col < n and cells[col]:
+                col += 1
+            path.rect(x + start * module, top, (col - start) * module, module)
+    c.drawPath(path, stroke=0, fill=1)
+
+
+def table_sheet(base_url, subdomain, restaurant_name, count):
+    # Print-ready PDF with SHEET_COLUMNS x SHEET_ROWS labelled codes per page.
+    urls = [customer_url(base_url, subdomain, t) for t in range(1, count + 1)]
+    matrices = pool_map(render_matrix, urls, POOL_THRESHOLD)
+
+    page_w, page_h = A4
+    cell_w = (page_w - 2 * SHEET_MARGIN) / SHEET_COLUMNS
+    cell_h = (page_h - 2 * SHEET_MARGIN) / SHEET_ROWS
+    per_page = SHEET_COLUMNS * SHEET_ROWS
+
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    c.setTitle(f"{restaurant_name} table QR codes")
+
+    for i, matrix in enumerate(matrices):
+        if i and i % per_page == 0:
+            c.showPage()
+
+        slot = i % per_page
+        left = SHEET_MARGIN + (slot % SHEET_COLUMNS) * cell_w
+        bottom = page_h - SHEET_MARGIN - (slot // SHEET_COLUMNS + 1) * cell_h
+        centre = left + cell_w / 2
+
+        # Cut guide
+        c.setStrokeGray(0.8)
+        c.setDash(2, 2)
+        c.rect(left, bottom, cell_w, cell_h, stroke=1, fill=0)
+        c.setDash()
+
+        qr_y = bottom + (cell_h - QR_SIZE) / 2
+        _draw_matrix(c, matrix, centre - QR_SIZE / 2, qr_y, QR_SIZE)
+
+        c.setFont("Helvetica-Bold", 14)
+        c.drawCentredString(centre, qr_y + QR_SIZE + 6 * mm, restaurant_name)
+        c.setFont("Helvetica", 12)
+        c.drawCentredString(centre, qr_y - 8 * mm, f"Table {i + 1}")
+
+    c.save()
+    buf.seek(0)
+    return buf
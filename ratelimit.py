@@ -0,0 +1,37 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Clients tracked per limiter per process. The least recently seen are
+# forgotten first, so a flood of addresses cannot grow memory unbounded.
+MAX_CLIENTS = 10000
+
+
+# ---------------- SLIDING WINDOW ----------------
+class RateLimiter:
+    # At most `limit` hits per `window` seconds per key. Counts are per
+    # gunicorn worker, so the effective limit is up to `limit` times the
+    # number of workers.
+
+    def __init__(self, limit, window=60.0, max_clients=MAX_CLIENTS):
+        self.limit = limit
+        self.window = window
+        self.max_clients = max_clients
+        self._hits = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                hits = self._hits[key] = deque()
+            self._hits.move_to_end(key)
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+            if len(hits) >= self.limit:
+                return False
+            hits.append(now)
+            while len(self._hits) > self.max_clients:
+                self._hits.popitem(last=False)
+            return True
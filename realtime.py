@@ -0,0 +1,377 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import metrics
+import shards
+import stats
+from db import connect, day_range, items_by_order, today
+from workers import ensure_thread
+
+# How often the watcher checks for commits made by other worker processes.
+POLL_INTERVAL = 0.5
+# Idle streams get a comment line so dead clients are noticed and closed.
+HEARTBEAT_INTERVAL = 15
+# Changes kept per restaurant for Last-Event-ID resume.
+HISTORY_SIZE = 256
+# A client further behind than this gets a fresh snapshot instead.
+MAX_BACKLOG = 512
+# How long a restaurant's history outlives its last subscriber, so a
+# dashboard that drops and reconnects resumes instead of re-snapshotting.
+# History lives in this process only: resume needs the reconnect to land
+# on the same gunicorn worker.
+IDLE_GRACE = 120
+
+# Event types a stream can carry; each subscriber picks a subset.
+TOPICS = ("order", "revenue", "addition")
+ADMIN_TOPICS = ("order", "revenue")
+KITCHEN_TOPICS = ("order", "addition")
+
+
+# ---------------- WRITER SIDE ----------------
+def touch(db, restaurant_id):
+    # Call inside the writer's transaction, before commit(). The version row
+    # is what other gunicorn workers on the same host watch for changes.
+    db.execute("""
+        INSERT INTO change_versions (restaurant_id, version)
+        VALUES (?, 1)
+        ON CONFLICT(restaurant_id) DO UPDATE SET version = version + 1
+    """, (restaurant_id,))
+
+
+# ---------------- SNAPSHOT ----------------
+def load_today(conn, restaurant_id, today):
+    start, end = day_range(today)
+
+    orders = conn.execute("""
+        SELECT *
+        FROM orders
+        WHERE restaurant_id=?
+        AND created_at >= ? AND created_at < ?
+        ORDER BY created_at DESC, id DESC
+    """, (restaurant_id, start, end)).fetchall()
+
+    revenue = stats.served_revenue(conn, restaurant_id, today)
+
+    additions = conn.execute("""
+        SELECT *
+        FROM order_additions
+        WHERE restaurant_id=?
+        AND status='New'
+        ORDER BY created_at ASC
+    """, (restaurant_id,)).fetchall()
+
+    lines = items_by_order(conn, restaurant_id, start, end)
+    orders = [dict(o) for o in orders]
+    for o in orders:
+        o["items"] = lines.get(o["id"], [])
+
+    return {
+        "orders": orders,
+        "today_revenue": revenue,
+        "additions": [dict(a) for a in additions]
+    }
+
+
+# ---------------- SSE FRAMES ----------------
+def sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def diff_rows(old, new):
+    upserted = [r for rid, r in new.items() if old.get(rid) != r]
+    removed = [rid for rid in old if rid not in new]
+    return upserted, removed
+
+
+# ---------------- SUBSCRIBER ----------------
+class Subscription:
+    def __init__(self, restaurant_id, last_event_id=None, topics=TOPICS):
+        self.restaurant_id = restaurant_id
+        self.last_event_id = last_event_id
+        self.topics = frozenset(topics)
+        self.synced = False
+        self._pending = deque()
+        self._ready = threading.Event()
+
+    def push(self, messages):
+        # messages are (topic, frame) pairs; frames outside our topics are
+        # dropped here so admins never pay for kitchen-only events.
+        frames = [frame for topic, frame in messages if topic in self.topics]
+        if frames:
+            self._pending.extend(frames)
+            self._ready.set()
+
+    def reset(self, frame):
+        # Used when a client fell too far behind to be worth replaying.
+        self._pending.clear()
+        self._pending.append(frame)
+        self._ready.set()
+
+    @property
+    def backlog(self):
+        return len(self._pending)
+
+    def wait(self, timeout):
+        self._ready.wait(timeout)
+        self._ready.clear()
+        messages = []
+        while self._pending:
+            messages.append(self._pending.popleft())
+        return messages
+
+
+class _Channel:
+    def __init__(self):
+        self.subscribers = set()
+        # monotonic time the last subscriber left; None while watched
+        self.idle_since = None
+        # Set when a subscriber returns: the channel was not refreshed while
+        # idle, so it must be checked even if data_version did not move.
+        self.stale = False
+        self.loaded = False
+        self.version = None
+        self.day = None
+        self.orders = {}
+        self.revenue = None
+        self.additions = {}
+        # Version a client may resume from without a snapshot. None right
+        # after a day rollover, because the visible order set changed
+        # without a new version.
+        self.resume_base = None
+        # (base_version, version, messages) for each observed change.
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self._snapshots = {}
+
+    def snapshot(self, topics):
+        frame = self._snapshots.get(topics)
+        if frame is None:
+            data = {}
+            if "order" in topics:
+                data["orders"] = list(self.orders.values())
+            if "revenue" in topics:
+                data["today_revenue"] = self.revenue
+            if "addition" in topics:
+                data["additions"] = list(self.additions.values())
+            frame = self._snapshots[topics] = sse("snapshot", data, self.version)
+        return frame
+
+    def catch_up(self, sub):
+        # Brings a subscriber at sub.last_event_id up to date.
+        if sub.last_event_id is not None and sub.last_event_id == self.resume_base:
+            return
+
+        replay = None
+        for base, _, messages in self.history:
+            if replay is None and base is not None and base == sub.last_event_id:
+                replay = []
+            if replay is not None:
+                replay.extend(messages)
+
+        if replay is None:
+            sub.reset(self.snapshot(sub.topics))
+        else:
+            sub.push(replay)
+
+    def apply(self, version, day, orders, revenue, additions):
+        rolled_over = self.loaded and day != self.day
+        upserted, removed = diff_rows(self.orders, orders)
+        added, taken = diff_rows(self.additions, additions)
+
+        messages = []
+        if upserted or removed:
+            messages.append(("order", sse("order", {
+                "upserted": upserted,
+                "removed": removed
+            }, version)))
+        if revenue != self.revenue:
+            messages.append(("revenue", sse(
+                "revenue", {"today_revenue": revenue}, version
+            )))
+        if added or taken:
+            messages.append(("addition", sse("addition", {
+                "upserted": added,
+                "removed": taken
+            }, version)))
+
+        if rolled_over or not self.loaded:
+            self.history.clear()
+            base = None
+        else:
+            base = self.resume_base
+        if self.loaded:
+            self.history.append((base, version, messages))
+
+        self.loaded = True
+        self.version = version
+        self.day = day
+        self.orders = orders
+        self.revenue = revenue
+        self.additions = additions
+        self.resume_base = None if rolled_over else version
+        self._snapshots = {}
+
+        return None if rolled_over else messages
+
+
+# ---------------- HUB ----------------
+class ChangeHub:
+    # One watcher thread per process reads each restaurant's data once per
+    # change and fans the resulting deltas out to every local subscriber.
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._channels = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def subscribe(self, restaurant_id, last_event_id=None, topics=TOPICS):
+        sub = Subscription(restaurant_id, last_event_id, topics)
+
+        with self._lock:
+            channel = self._channels.setdefault(restaurant_id, _Channel())
+            if channel.idle_since is not None:
+                channel.idle_since = None
+                channel.stale = True
+            channel.subscribers.add(sub)
+            if channel.loaded:
+                channel.catch_up(sub)
+                sub.synced = True
+            self._ensure_thread()
+
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            channel = self._channels.get(sub.restaurant_id)
+            if channel is None:
+                return
+            channel.subscribers.discard(sub)
+            if not channel.subscribers:
+                # Kept for IDLE_GRACE with its history; see _expire()
+                channel.idle_since = time.monotonic()
+
+    def _expire(self):
+        # Drops channels idle for longer than IDLE_GRACE. Call under _lock.
+        cutoff = time.monotonic() - IDLE_GRACE
+        for rid in [
+            rid for rid, c in self._channels.items()
+            if c.idle_since is not None and c.idle_since < cutoff
+        ]:
+            del self._channels[rid]
+
+    def notify(self, restaurant_id=None):
+        # Writers in this process call this after commit() so local
+        # subscribers don't wait for the next poll.
+        self._wake.set()
+
+    def _ensure_thread(self):
+        self._thread = ensure_thread(self._thread, self._run, "change-hub")
+
+    def _run(self):
+        # One connection per database file being watched: the central one,
+        # or the shard of each restaurant with subscribers.
+        conns = {}
+        last_data_versions = {}
+
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+            with self._lock:
+                self._expire()
+                # Idle channels are not refreshed; a returning subscriber
+                # marks them stale and the next refresh sends one delta
+                # covering everything missed meanwhile.
+                channels = {
+                    rid: c for rid, c in self._channels.items() if c.subscribers
+                }
+
+            by_path = {}
+            for rid, channel in channels.items():
+                by_path.setdefault(shards.shard_path(rid), {})[rid] = channel
+            for path in set(conns) - set(by_path):
+                conns.pop(path).close()
+                last_data_versions.pop(path, None)
+
+            day = today()
+            for path, group in by_path.items():
+                if path not in conns:
+                    # Opening a missing shard would create an empty one
+                    if not os.path.exists(path):
+                        continue
+                    conns[path] = connect(path)
+                conn = conns[path]
+
+                # data_version only moves when another connection commits, so
+                # an idle database costs one PRAGMA per tick.
+                data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+                fresh = any(
+                    not c.loaded or c.stale or c.day != day for c in group.values()
+                )
+                if data_version == last_data_versions.get(path) and not fresh:
+                    continue
+                last_data_versions[path] = data_version
+
+                try:
+                    self._refresh(conn, group, day)
+                except sqlite3.Error:
+                    # Locked or mid-migration; the next tick retries.
+                    continue
+
+    def _refresh(self, conn, channels, today):
+        marks = ",".join("?" * len(channels))
+        versions = dict(conn.execute(f"""
+            SELECT restaurant_id, version
+            FROM change_versions
+            WHERE restaurant_id IN ({marks})
+        """, tuple(channels)).fetchall())
+
+        for rid, channel in channels.items():
+            version = versions.get(rid, 0)
+            channel.stale = False
+            if channel.loaded and channel.version == version and channel.day == today:
+                continue
+
+            snapshot = load_today(conn, rid, today)
+            orders = {o["id"]: o for o in snapshot["orders"]}
+            additions = {a["id"]: a for a in snapshot["additions"]}
+
+            with self._lock:
+                messages = channel.apply(
+                    version, today, orders, snapshot["today_revenue"], additions
+                )
+                for sub in channel.subscribers:
+                    if not sub.synced:
+                        channel.catch_up(sub)
+                        sub.synced = True
+                    elif messages is None or sub.backlog > MAX_BACKLOG:
+                        # Day rollover or a stalled client: start over.
+                        sub.reset(channel.snapshot(sub.topics))
+                    elif messages:
+                        sub.push(messages)
+
+
+hub = ChangeHub()
+
+
+def stream(restaurant_id, last_event_id=None, topics=TOPICS):
+    sub = hub.subscribe(restaurant_id, last_event_id, topics)
+    metrics.stream_opened(restaurant_id)
+    try:
+        while True:
+            messages = sub.wait(HEARTBEAT_INTERVAL)
+            if not messages:
+                yield ": keepalive\n\n"
+            for message in messages:
+                metrics.stream_sent(restaurant_id, len(message))
+                yield message
+    finally:
+        hub.unsubscribe(sub)
+        metrics.stream_closed(restaurant_id)
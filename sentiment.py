@@ -0,0 +1,155 @@
+import os
+import threading
+
+import keywords
+
+# Feedback is scored here in batches by `flask --app app feedback-worker`,
+# never while a request waits. The model is a weighted word list applied
+# as one sparse matrix product per batch, so a batch of hundreds costs
+# about as much as a handful of single comments.
+BATCH_SIZE = int(os.environ.get("SENTIMENT_BATCH", 500))
+MODEL_NAME = "lexicon-1"
+
+# Same scale and cut-offs as VADER: raw sums are squashed into -1..1
+NORMALIZE_ALPHA = 15
+POSITIVE_AT = 0.05
+NEGATIVE_AT = -0.05
+
+LEXICON = {
+    # food
+    "delicious": 3.0, "tasty": 2.5, "yummy": 2.5, "flavourful": 2.3, "flavorful": 2.3,
+    "fresh": 1.8, "crispy": 1.5, "tender": 1.6, "juicy": 1.6, "authentic": 1.8,
+    "perfect": 3.0, "perfectly": 2.5, "hot": 0.8, "spicy": 0.3,
+    "cold": -1.8, "stale": -2.5, "soggy": -2.0, "bland": -2.0, "tasteless": -2.5,
+    "salty": -1.5, "oily": -1.5, "greasy": -1.6, "burnt": -2.2, "undercooked": -2.4,
+    "raw": -1.5, "overcooked": -1.8, "dry": -1.2, "hard": -1.0, "rotten": -3.2,
+    "disgusting": -3.2, "inedible": -3.2, "hair": -2.0, "smelly": -2.3,
+    # service
+    "quick": 1.8, "fast": 1.8, "prompt": 1.8, "friendly": 2.2, "polite": 2.0,
+    "helpful": 2.0, "attentive": 2.0, "courteous": 2.0, "welcoming": 2.0,
+    "slow": -1.8, "late": -1.8, "delay": -1.8, "delayed": -1.8, "waiting": -1.0,
+    "waited": -1.2, "forgot": -1.8, "forgotten": -1.8, "wrong": -1.8, "missing": -1.6,
+    "rude": -2.8, "ignored": -2.2, "unprofessional": -2.4, "careless": -2.0,
+    # place and price
+    "clean": 1.8, "cozy": 1.8, "cosy": 1.8, "ambience": 0.8, "ambiance": 0.8,
+    "dirty": -2.5, "noisy": -1.4, "crowded": -1.0, "smell": -1.0,
+    "cheap": 0.5, "affordable": 1.6, "worth": 1.6, "value": 1.0,
+    "overpriced": -2.2, "expensive": -1.2, "costly": -1.2, "pricey": -1.0,
+    # general
+    "good": 1.9, "great": 3.1, "excellent": 3.2, "amazing": 3.1, "awesome": 3.1,
+    "fantastic": 3.2, "wonderful": 3.1, "superb": 3.1, "outstanding": 3.2,
+    "best": 3.0, "love": 3.2, "loved": 2.9, "like": 1.5, "liked": 1.8, "enjoyed": 2.3,
+    "nice": 1.8, "lovely": 2.8, "happy": 2.7, "satisfied": 1.8, "recommend": 2.0,
+    "fine": 0.8, "ok": 0.9, "okay": 0.9, "decent": 1.2, "thanks": 1.9, "thank": 1.5,
+    "bad": -2.5, "worst": -3.1, "terrible": -3.0, "horrible": -3.0, "awful": -3.1,
+    "poor": -2.1, "pathetic": -2.8, "disappointing": -2.4, "disappointed": -2.2,
+    "hate": -2.7, "never": -0.5, "unhappy": -2.2, "sick": -2.2, "refund": -1.5,
+    "complaint": -1.8, "waste": -2.2, "mediocre": -1.4, "average": -0.3,
+}
+
+# "not good" counts as the opposite of "good"; "very good" as more of it
+NEGATIONS = (
+    "not", "no", "never", "isn", "wasn", "weren", "aren", "didn", "don",
+    "doesn", "hardly", "nothing", "without",
+)
+NEGATION_FACTOR = -0.74
+BOOSTERS = ("very", "really", "extremely", "super", "so", "too", "absolutely", "totally")
+BOOSTER_FACTOR = 0.3
+
+
+# ---------------- MODEL ----------------
+class LexiconModel:
+    # Unigram weights from LEXICON plus "negator word" and "booster word"
+    # bigrams. A bigram's weight is the adjustment on top of the unigram,
+    # which CountVectorizer also counts inside it.
+
+    def __init__(self, lexicon=LEXICON):
+        import numpy as np
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        weights = dict(lexicon)
+        for word, w in lexicon.items():
+            for neg in NEGATIONS:
+                weights.setdefault(f"{neg} {word}", w * NEGATION_FACTOR - w)
+            for boost in BOOSTERS:
+                weights.setdefault(f"{boost} {word}", w * BOOSTER_FACTOR)
+
+        vocabulary = sorted(weights)
+        self.vectorizer = CountVectorizer(
+            vocabulary=vocabulary, ngram_range=(1, 2), lowercase=True
+        )
+        self.weights = np.array([weights[t] for t in vocabulary])
+        self._np = np
+
+    def scores(self, texts):
+        # -1..1 per text, one sparse product for the whole batch
+        np = self._np
+        raw = self.vectorizer.transform(texts) @ self.weights
+        return raw / np.sqrt(raw * raw + NORMALIZE_ALPHA)
+
+
+def label(score):
+    if score >= POSITIVE_AT:
+        return "positive"
+    if score <= NEGATIVE_AT:
+        return "negative"
+    return "neutral"
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def model():
+    # Built once per process, on first use, so web workers (which only
+    # read stored scores) never import scikit-learn.
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = LexiconModel()
+    return _model
+
+
+def score(texts):
+    # [(score, label)] in the order given
+    values = model().scores(texts)
+    return [(round(float(v), 4), label(v)) for v in values]
+
+
+# ---------------- WORKER ----------------
+def process_pending(db, limit=BATCH_SIZE):
+    # Scores up to `limit` unscored comments in one batch and stores the
+    # results, and their keyword counts, in one transaction. Returns how
+    # many were scored.
+    rows = db.execute("""
+        SELECT id, restaurant_id, comment, created_at FROM feedback
+        WHERE sentiment IS NULL AND comment IS NOT NULL
+        ORDER BY id
+        LIMIT ?
+    """, (limit,)).fetchall()
+    if not rows:
+        # Idle: roll stored keyword results over to a new day
+        stale = keywords.outdated(db)
+        if stale:
+            keywords.refresh(db, stale)
+            db.commit()
+        return 0
+
+    results = score([r["comment"] for r in rows])
+    db.executemany("""
+        UPDATE feedback
+        SET sentiment=?, sentiment_label=?, sentiment_model=?, scored_at=CURRENT_TIMESTAMP
+        WHERE id=?
+    """, [
+        (value, name, MODEL_NAME, r["id"])
+        for r, (value, name) in zip(rows, results)
+    ])
+    # Keyword counts move in the same transaction as the scores
+    touched = keywords.add(db, [
+        (r["restaurant_id"], r["created_at"], r["comment"], name)
+        for r, (_, name) in zip(rows, results)
+    ])
+    keywords.refresh(db, touched)
+    db.commit()
+    return len(rows)
@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+from db import DB_PATH, ConnectionPool, connect, get_db, init_db
+
+# TENANT_SHARD_DIR turns on per-restaurant storage: each restaurant's
+# operational tables live in <dir>/restaurant_<id>.db, so one tenant's
+# writes never wait on another's. The central DB_PATH keeps the catalog
+# (restaurants, users) used for login, signup and subdomain routing.
+#
+# Shards are created with the full schema, including a copy of their own
+# restaurants row, so queries that join orders to the restaurant work
+# unchanged. That copy is authoritative for menu_version.
+SHARD_DIR = os.environ.get("TENANT_SHARD_DIR")
+
+# Idle connections kept per shard per process. Many tenants times a big
+# pool would mean thousands of open files.
+SHARD_POOL_SIZE = int(os.environ.get("TENANT_POOL_SIZE", 2))
+FAN_OUT_WORKERS = int(os.environ.get("TENANT_FAN_OUT_WORKERS", 8))
+
+# Everything stored per restaurant, with the filter selecting one
+# restaurant's rows from the central database.
+TENANT_TABLES = {
+    "restaurants": "id=?",
+    "menu": "restaurant_id=?",
+    "orders": "restaurant_id=?",
+    "order_additions": "restaurant_id=?",
+    "order_items": "restaurant_id=?",
+    "daily_stats": "restaurant_id=?",
+    "restaurant_totals": "restaurant_id=?",
+    "change_versions": "restaurant_id=?",
+    "print_jobs": "restaurant_id=?",
+    "feedback": "restaurant_id=?",
+    "feedback_terms": "restaurant_id=?",
+    "feedback_term_totals": "restaurant_id=?",
+    "keyword_cache": "restaurant_id=?",
+    "image_jobs": "source IN (SELECT image FROM src.menu WHERE restaurant_id=?)",
+}
+# Left in the central database by --purge: the catalog, and image jobs,
+# which may be shared by several restaurants.
+CENTRAL_TABLES = ("restaurants", "image_jobs")
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def enabled():
+    return bool(SHARD_DIR)
+
+
+def shard_path(restaurant_id):
+    # The file holding this restaurant's orders and menu: its shard, or
+    # the central database when sharding is off
+    if not SHARD_DIR:
+        return DB_PATH
+    return os.path.join(SHARD_DIR, f"restaurant_{int(restaurant_id)}.db")
+
+
+def _pool(path):
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path, SHARD_POOL_SIZE)
+        return _pools[path]
+
+
+# ---------------- REQUEST CONNECTIONS ----------------
+def get_tenant_db(restaurant_id):
+    # The connection holding this restaurant's menu and orders; the
+    # central connection when sharding is off.
+    if not SHARD_DIR:
+        return get_db()
+
+    if "tenant_dbs" not in g:
+        g.tenant_dbs = {}
+    if restaurant_id not in g.tenant_dbs:
+        path = shard_path(restaurant_id)
+        # sqlite3.connect would quietly create an empty file
+        if not os.path.exists(path):
+            raise LookupError(f"no shard for restaurant {restaurant_id}")
+        g.tenant_dbs[restaurant_id] = _pool(path).acquire()
+    return g.tenant_dbs[restaurant_id]
+
+
+def close_tenant_dbs(e=None):
+    for restaurant_id, conn in g.pop("tenant_dbs", {}).items():
+        _pool(shard_path(restaurant_id)).release(conn)
+
+
+def tenant_ids():
+    return [r[0] for r in get_db().execute("SELECT id FROM restaurants ORDER BY id")]
+
+
+def all_tenant_dbs():
+    # Every connection holding restaurant data, for CLI commands: the
+    # central one, or one per shard. Restaurants not migrated yet have no
+    # shard and are skipped until `flask shard-tenants` creates it.
+    if not SHARD_DIR:
+        return [get_db()]
+    return [
+        get_tenant_db(rid) for rid in tenant_ids()
+        if os.path.exists(shard_path(rid))
+    ]
+
+
+def all_menu_dbs():
+    # all_tenant_dbs() plus, with sharding on, the central database, which
+    # still holds the menus of restaurants not migrated yet (and every
+    # menu until --purge).
+    if not SHARD_DIR:
+        return [get_db()]
+    return all_tenant_dbs() + [get_db()]
+
+
+def fan_out(fn, restaurant_ids):
+    # fn(restaurant_id, conn) on every shard, several at a time; None for
+    # restaurants without a shard yet. Each call borrows its own
+    # connection, so this is safe outside a request too.
+    def run(rid):
+        path = shard_path(rid)
+        if not os.path.exists(path):
+            return None
+        pool = _pool(path)
+        conn = pool.acquire()
+        try:
+            return fn(rid, conn)
+        finally:
+            pool.release(conn)
+
+    with ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS) as executor:
+        return list(executor.map(run, restaurant_ids))
+
+
+# ---------------- CREATE / MIGRATE ----------------
+def _copy(conn, table, where, params):
+    # Column lists are matched by name: add_column() leaves older
+    # databases with a different column order than a fresh shard.
+    shard_cols = {r[1] for r in conn.execute(f"PRAGMA main.table_info({table})")}
+    cols = ", ".join(
+        r[1] for r in conn.execute(f"PRAGMA src.table_info({table})")
+        if r[1] in shard_cols
+    )
+    return conn.execute(f"""
+        INSERT OR REPLACE INTO main.{table} ({cols})
+        SELECT {cols} FROM src.{table} WHERE {where}
+    """, params).rowcount
+
+
+def ensure_shard(restaurant_id):
+    # Creates a restaurant's shard from its rows in the central database.
+    # An existing shard is never overwritten: once created it is the live
+    # copy. Returns table -> rows copied, or None if it already existed.
+    path = shard_path(restaurant_id)
+    if os.path.exists(path):
+        return None
+
+    # Built under a temporary name, so an interrupted copy never leaves a
+    # shard that looks finished.
+    tmp = path + ".tmp"
+    for leftover in (tmp, tmp + "-wal", tmp + "-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    init_db(tmp)
+
+    conn = connect(tmp)
+    conn.execute("ATTACH DATABASE ? AS src", (DB_PATH,))
+    try:
+        copied = {
+            table: _copy(conn, table, where, (restaurant_id,))
+            for table, where in TENANT_TABLES.items()
+        }
+        expected = count_rows(conn, restaurant_id, "src")
+        if count_rows(conn, restaurant_id) != expected:
+            raise RuntimeError(f"restaurant {restaurant_id}: shard rows differ from the source")
+        conn.execute(
+            "INSERT OR IGNORE INTO restaurant_totals (restaurant_id) VALUES (?)",
+            (restaurant_id,)
+        )
+        conn.commit()
+    finally:
+        conn.rollback()
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+
+    os.replace(tmp, path)
+    return copied
+
+
+def init_shards():
+    # Startup: brings the schema of every existing shard up to date.
+    # Restaurants without one yet need `flask shard-tenants`.
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    conn = connect(DB_PATH)
+    ids = [r[0] for r in conn.execute("SELECT id FROM restaurants")]
+    conn.close()
+    for rid in ids:
+        if os.path.exists(shard_path(rid)):
+            init_db(shard_path(rid))
+
+
+def count_rows(conn, restaurant_id, schema="main"):
+    return {
+        table: conn.execute(
+            f"SELECT COUNT(*) FROM {schema}.{table} WHERE {where}".replace("src.", f"{schema}."),
+            (restaurant_id,)
+        ).fetchone()[0]
+        for table, where in TENANT_TABLES.items()
+    }
+
+
+def migrate(purge=False, echo=print):
+    # Splits the central database into shards; restaurants that already
+    # have one are skipped, so it is safe to re-run. Stop the web workers
+    # first so no writes land in the central copy meanwhile.
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    central = connect(DB_PATH)
+    ids = [r[0] for r in central.execute("SELECT id FROM restaurants ORDER BY id")]
+
+    for rid in ids:
+        copied = ensure_shard(rid)
+        if copied is None:
+            echo(f"restaurant {rid}: already sharded")
+        else:
+            echo(f"restaurant {rid}: {sum(copied.values())} rows")
+
+    if purge:
+        for table in TENANT_TABLES:
+            if table not in CENTRAL_TABLES:
+                central.execute(f"DELETE FROM {table}")
+        central.commit()
+        try:
+            central.execute("VACUUM")
+        except sqlite3.OperationalError:
+            pass
+    central.close()
+    return len(ids)
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# SLOW_QUERY_MS=<ms> logs every statement that runs longer, with its
+# (redacted) parameters and EXPLAIN QUERY PLAN, one JSON object per line.
+# `flask --app app slow-queries` summarizes the log.
+THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_MS") or 0)
+ENABLED = THRESHOLD_MS > 0
+# Next to the database by default (db.py's DB_PATH lives in this
+# directory unless RESTAURANT_DB says otherwise), not in whatever
+# directory gunicorn happened to be started from.
+LOG_PATH = os.environ.get("SLOW_QUERY_LOG") or os.path.join(
+    os.path.dirname(os.path.abspath(os.environ.get("RESTAURANT_DB", __file__))),
+    "slow_queries.log"
+)
+# Tables with more rows than this are worth an index when scanned
+LARGE_TABLE_ROWS = 10000
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_lock = threading.Lock()
+# (database, normalized sql) -> plan lines; plans are looked up once per
+# statement per process, not on every slow run
+_plans = {}
+
+
+# ---------------- RECORDING ----------------
+def redact(value):
+    # Ids, prices and flags are kept; text and blobs only by size
+    if isinstance(value, str):
+        return f"<text:{len(value)}>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<blob:{len(value)}>"
+    return value
+
+
+def redact_params(params):
+    if isinstance(params, dict):
+        return {k: redact(v) for k, v in params.items()}
+    return [redact(v) for v in params]
+
+
+def explain(conn, sql, params):
+    if not sql.lstrip()[:7].upper().startswith(EXPLAINABLE):
+        return []
+    # A plain cursor, so the EXPLAIN itself is not timed and logged
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        return [row[3] for row in cur.execute("EXPLAIN QUERY PLAN " + sql, params)]
+    except sqlite3.Error as e:
+        return [f"(no plan: {e})"]
+    finally:
+        cur.close()
+
+
+def database_of(conn):
+    cur = conn.cursor(sqlite3.Cursor)
+    try:
+        return cur.execute("PRAGMA database_list").fetchone()[2]
+    finally:
+        cur.close()
+
+
+def record(conn, sql, normalized, params, elapsed, many=False):
+    # Called by the instrumented cursor once a statement over the
+    # threshold has finished. Never raises into the caller's query.
+    try:
+        first = (params[0] if params else ()) if many else params
+        database = database_of(conn)
+        key = (database, normalized)
+        plan = _plans.get(key)
+        if plan is None:
+            plan = _plans[key] = explain(conn, sql, first)
+
+        line = json.dumps({
+            "at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "ms": round(elapsed * 1000, 2),
+            "sql": normalized,
+            "params": redact_params(first),
+            "rows": len(params) if many else None,
+            "db": database,
+            "plan": plan,
+        }, default=str)
+        with _lock, open(LOG_PATH, "a") as f:
+            f.write(line + "\n")
+    except (sqlite3.Error, OSError, TypeError, ValueError):
+        pass
+
+
+# ---------------- REPORT ----------------
+def load(path=LOG_PATH):
+    # Groups the log by normalized SQL, slowest total time first
+    groups = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            group = groups.setdefault((entry["db"], entry["sql"]), {
+                "sql": entry["sql"],
+                "db": entry["db"],
+                "plan": entry["plan"],
+                "timings": [],
+                "example_params": entry["params"],
+            })
+            group["timings"].append(entry["ms"])
+
+    for group in groups.values():
+        timings = sorted(group.pop("timings"))
+        group.update(
+            count=len(timings),
+            total_ms=round(sum(timings), 2),
+            p50_ms=timings[len(timings) // 2],
+            max_ms=timings[-1],
+        )
+    return sorted(groups.values(), key=lambda g: g["total_ms"], reverse=True)
+
+
+_SCAN = re.compile(r"^SCAN (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?")
+_SEARCH = re.compile(r"^SEARCH (\w+)(?: AS \w+)? USING (?:COVERING |INTEGER PRIMARY KEY )?(?:INDEX (\w+) )?\(([^)]*)\)")
+_EQUALS = re.compile(r"(?:\b(\w+)\.)?\b(\w+)\s*(?:=|\bIN\b)", re.IGNORECASE)
+_RANGES = re.compile(r"(?:\b(\w+)\.)?\b(\w+)\s*(?:<=|>=|<|>|\bBETWEEN\b)", re.IGNORECASE)
+_ORDER_BY = re.compile(r"\bORDER BY (.+?)(?:\bLIMIT\b|$)", re.IGNORECASE)
+
+
+def _where(sql):
+    # The WHERE clause(s) of the statement, ORDER BY/LIMIT stripped
+    parts = re.split(r"\bWHERE\b", sql, flags=re.IGNORECASE)[1:]
+    return " ".join(re.split(r"\b(?:ORDER BY|GROUP BY|LIMIT)\b", p, flags=re.IGNORECASE)[0] for p in parts)
+
+
+def suggest_index(conn, table, sql):
+    # Equality columns first, then one range or ORDER BY column: the
+    # shape SQLite can use for both the filter and the sort.
+    columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+    if not columns:
+        return None
+    where = _where(sql)
+
+    picked = []
+    for _, col in _EQUALS.findall(where):
+        if col in columns and col not in picked:
+            picked.append(col)
+    tail = [c for _, c in _RANGES.findall(where) if c in columns]
+    order = _ORDER_BY.search(sql)
+    if order:
+        tail += [
+            c.split(".")[-1].split()[0] for c in order.group(1).split(",")
+            if c.split(".")[-1].split()[0] in columns
+        ]
+    for col in tail[:1]:
+        if col not in picked:
+            picked.append(col)
+
+    if not picked:
+        return None
+    return f"CREATE INDEX idx_{table}_{'_'.join(picked)} ON {table}({', '.join(picked)})"
+
+
+def table_rows(conn, table):
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def findings(conn, group, large_rows=LARGE_TABLE_ROWS):
+    # (problem, suggestion) pairs for one statement's plan
+    found = []
+    where = _where(group["sql"])
+    for step in group["plan"]:
+        step = step.strip()
+
+        scan = _SCAN.match(step)
+        if scan:
+            table, index = scan.groups()
+            rows = table_rows(conn, table)
+            if rows is None or rows < large_rows or not where:
+                continue
+            how = f"via {index}" if index else "full table"
+            found.append((
+                f"scans {table} ({rows} rows, {how})",
+                suggest_index(conn, table, group["sql"])
+            ))
+            continue
+
+        search = _SEARCH.match(step)
+        if search:
+            table, index, used = search.groups()
+            used_cols = {c.split("=")[0].split(">")[0].split("<")[0].strip() for c in used.split(" AND ")}
+            wanted = {col for _, col in _EQUALS.findall(where)}
+            columns = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+            missing = (wanted & columns) - used_cols
+            if index and missing:
+                found.append((
+                    f"{table}: {index} covers {', '.join(sorted(used_cols))} but not "
+                    f"{', '.join(sorted(missing))}",
+                    suggest_index(conn, table, group["sql"])
+                ))
+            continue
+
+        if "USE TEMP B-TREE FOR ORDER BY" in step:
+            found.append(("sorts rows in a temporary b-tree", None))
+    return found
+
+
+def report(groups, top=20, large_rows=LARGE_TABLE_ROWS, echo=print):
+    # The databases named in the log are opened read-only, to count rows
+    # and read table columns for the suggestions.
+    conns = {}
+    try:
+        for group in groups[:top]:
+            echo(
+                f"{group['count']}x  total {group['total_ms']} ms  "
+                f"p50 {group['p50_ms']} ms  max {group['max_ms']} ms  [{os.path.basename(group['db'] or '')}]"
+            )
+            echo(f"  {group['sql'][:300]}")
+            echo(f"  params e.g. {json.dumps(group['example_params'])}")
+            for step in group["plan"]:
+                echo(f"    plan: {step}")
+
+            db = group["db"]
+            if db and os.path.exists(db):
+                if db not in conns:
+                    conns[db] = sqlite3.connect(f"file:{db}?mode=ro", uri=True)
+                for problem, suggestion in findings(conns[db], group, large_rows):
+                    echo(f"  ! {problem}")
+                    if suggestion:
+                        echo(f"    try: {suggestion}")
+            echo("")
+    finally:
+        for conn in conns.values():
+            conn.close()
@@ -21,7 +21,7 @@ function renderOrders(orders) {
     orders.forEach(o => {
         if (o.status !== "Served") pending++;
 
-        const items = JSON.parse(o.items)
+        const items = o.items
             .map(i => `${i.qty}× ${i.name}`)
             .join(", ");
 
@@ -66,6 +66,13 @@ function renderOrders(orders) {
                               w-9 h-9 rounded bg-black text-white">
                         <i class="fas fa-print text-xs"></i>
                     </a>
+
+                    <button onclick="printReceipt(${o.id})"
+                       title="Send to Receipt Printer"
+                       class="inline-flex items-center justify-center
+                              w-9 h-9 rounded bg-gray-700 text-white">
+                        <i class="fas fa-receipt text-xs"></i>
+                    </button>
                 </td>
             </tr>
         `;
@@ -82,6 +89,18 @@ function updateStatus(orderId, status) {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ status })
+    })
+    .then(res => res.ok || res.json().then(data => alert(data.error || "Could not update the order")));
+}
+
+/* =========================
+   RECEIPT PRINTER (ESC/POS)
+========================= */
+function printReceipt(orderId) {
+    fetch(`/bill/${orderId}/print`, { method: "POST" })
+    .then(res => res.json())
+    .then(data => {
+        if (data.error) alert(data.error);
     });
 }
 
@@ -139,14 +158,34 @@ function confirmAddItem() {
 
 /* =========================
    SSE – TODAY ONLY
+   (snapshot first, then deltas)
 ========================= */
+const todayOrders = new Map();
+
+function renderToday() {
+    renderOrders([...todayOrders.values()].sort((a, b) => b.id - a.id));
+}
+
 const source = new EventSource("/events");
 
-source.onmessage = (event) => {
+source.addEventListener("snapshot", (event) => {
     const data = JSON.parse(event.data);
-    renderOrders(data.orders);
+    todayOrders.clear();
+    data.orders.forEach(o => todayOrders.set(o.id, o));
+    renderToday();
     revenueEl.innerText = `₹${data.today_revenue}`;
-};
+});
+
+source.addEventListener("order", (event) => {
+    const delta = JSON.parse(event.data);
+    delta.upserted.forEach(o => todayOrders.set(o.id, o));
+    delta.removed.forEach(id => todayOrders.delete(id));
+    renderToday();
+});
+
+source.addEventListener("revenue", (event) => {
+    revenueEl.innerText = `₹${JSON.parse(event.data).today_revenue}`;
+});
 
 source.onerror = () => {
     console.warn("SSE disconnected");
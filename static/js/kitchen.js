@@ -24,7 +24,7 @@ function renderOrders(orders) {
     }
 
     active.forEach(o => {
-        const items = JSON.parse(o.items)
+        const items = o.items
             .map(i => `${i.qty} × ${i.name}`)
             .join("<br>");
 
@@ -62,73 +62,99 @@ async function updateStatus(orderId, status) {
 
     updatingOrders.add(orderId);
 
-    await fetch(`/api/order/${orderId}/status`, {
+    const res = await fetch(`/api/order/${orderId}/status`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ status })
     });
+    if (!res.ok) alert((await res.json().catch(() => ({}))).error || "Could not update the order");
 
     updatingOrders.delete(orderId);
 }
 
 /* ===============================
    SSE – ONLY NORMAL ORDERS
+   (snapshot first, then deltas)
 ================================ */
+const todayOrders = new Map();
+
+function applyOrders() {
+    lastOrders = [...todayOrders.values()].sort((a, b) => b.id - a.id);
+    renderOrders(lastOrders);
+}
+
 const source = new EventSource("/events");
 
-source.onmessage = (event) => {
+source.addEventListener("snapshot", (event) => {
     const data = JSON.parse(event.data);
-    lastOrders = data.orders;
-    renderOrders(lastOrders);
-};
+    todayOrders.clear();
+    data.orders.forEach(o => todayOrders.set(o.id, o));
+    applyOrders();
+});
+
+source.addEventListener("order", (event) => {
+    const delta = JSON.parse(event.data);
+    delta.upserted.forEach(o => todayOrders.set(o.id, o));
+    delta.removed.forEach(id => todayOrders.delete(id));
+    applyOrders();
+});
 
 /* ===============================
-   🔥 NEW ITEM ADDITIONS (POLLING)
+   🔥 NEW ITEM ADDITIONS (SAME STREAM)
 ================================ */
-function loadAdditions() {
-    fetch("/api/kitchen/additions")
-        .then(res => res.json())
-        .then(additions => {
-            additionsContainer.innerHTML = "";
-
-            if (additions.length === 0) {
-                additionsContainer.innerHTML = `
-                    <p class="text-gray-400">No new additions</p>
-                `;
-                return;
-            }
-
-            additions.forEach(a => {
-                additionsContainer.innerHTML += `
-                    <div class="bg-red-600 text-white p-4 rounded-lg mb-3">
-                        <h3 class="font-black text-lg">
-                            TABLE ${a.table_no} – ADD ITEM
-                        </h3>
-                        <p class="text-sm mt-1">
-                            ${a.qty} × ${a.item_name}
-                        </p>
-
-                        <button
-                            onclick="markAdditionDone(${a.id})"
-                            class="mt-3 bg-black px-4 py-2 rounded text-sm">
-                            Mark Preparing
-                        </button>
-                    </div>
-                `;
-            });
+const newAdditions = new Map();
+
+function renderAdditions() {
+    additionsContainer.innerHTML = "";
+
+    if (newAdditions.size === 0) {
+        additionsContainer.innerHTML = `
+            <p class="text-gray-400">No new additions</p>
+        `;
+        return;
+    }
+
+    [...newAdditions.values()]
+        .sort((a, b) => a.id - b.id)
+        .forEach(a => {
+            additionsContainer.innerHTML += `
+                <div class="bg-red-600 text-white p-4 rounded-lg mb-3">
+                    <h3 class="font-black text-lg">
+                        TABLE ${a.table_no} – ADD ITEM
+                    </h3>
+                    <p class="text-sm mt-1">
+                        ${a.qty} × ${a.item_name}
+                    </p>
+
+                    <button
+                        onclick="markAdditionDone(${a.id})"
+                        class="mt-3 bg-black px-4 py-2 rounded text-sm">
+                        Mark Preparing
+                    </button>
+                </div>
+            `;
         });
 }
 
+source.addEventListener("snapshot", (event) => {
+    const data = JSON.parse(event.data);
+    newAdditions.clear();
+    data.additions.forEach(a => newAdditions.set(a.id, a));
+    renderAdditions();
+});
+
+source.addEventListener("addition", (event) => {
+    const delta = JSON.parse(event.data);
+    delta.upserted.forEach(a => newAdditions.set(a.id, a));
+    delta.removed.forEach(id => newAdditions.delete(id));
+    renderAdditions();
+});
+
 function markAdditionDone(id) {
+    /* The stream drops the card once the status change is committed */
     fetch(`/api/kitchen/addition/${id}/status`, {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ status: "Preparing" })
-    }).then(loadAdditions);
+    });
 }
-
-/* 🔁 Poll every 3 seconds */
-setInterval(loadAdditions, 3000);
-
-/* Initial load */
-loadAdditions();
@@ -31,9 +31,11 @@ function loadMenu(category = null) {
             items
                 .filter(item => !category || item.category === category)
                 .forEach(item => {
-                    const imgSrc = item.image
-                        ? `/${item.image}`
-                        : "/static/no-image.png";
+                    const image = item.image_medium || item.image;
+                    // Bulk imports may point at external image URLs
+                    const imgSrc = !image
+                        ? "/static/no-image.png"
+                        : /^https?:\/\//.test(image) ? image : `/${image}`;
 
                     menuGrid.innerHTML += `
                         <div class="bg-white rounded-xl shadow overflow-hidden">
@@ -129,8 +131,8 @@ document.getElementById("menu-form").onsubmit = e => {
         .catch(() => alert("Failed to add dish"));
 };
 function addToOrder(itemId) {
-    const qty = prompt("Enter quantity", 1);
-    if (!qty || qty <= 0) return;
+    const qty = parseInt(prompt("Enter quantity", 1), 10);
+    if (!(qty > 0)) return;
 
     fetch(`/api/order/${ORDER_ID}/add-item`, {
         method: "POST",
@@ -141,7 +143,8 @@ function addToOrder(itemId) {
         })
     })
         .then(res => res.json())
-        .then(() => {
+        .then(data => {
+            if (data.error) return alert(data.error);
             alert("Item added to order & sent to kitchen 🍽️");
             window.location.href = "/admin";
         });
@@ -166,7 +169,7 @@ function closeAddToOrderModal() {
 }
 
 function confirmAddToOrder() {
-    const qty = document.getElementById("modal-qty").value;
+    const qty = parseInt(document.getElementById("modal-qty").value, 10);
     const params = new URLSearchParams(window.location.search);
 
     fetch(`/api/order/${params.get("add_to_order")}/add-item`, {
@@ -176,7 +179,10 @@ function confirmAddToOrder() {
             item_id: selectedItemId,
             qty: qty
         })
-    }).then(() => {
+    })
+    .then(res => res.json())
+    .then(data => {
+        if (data.error) return alert(data.error);
         closeAddToOrderModal();
         alert(`✅ ${selectedItemName} added to table`);
         window.location.href = "/admin"; // back to dashboard
@@ -203,6 +209,35 @@ function importTemplate(type) {
         });
 }
 
+/* ================= BULK IMPORT (CSV / JSON) ================= */
+function bulkImport(input) {
+    const file = input.files[0];
+    if (!file) return;
+
+    const formData = new FormData();
+    formData.append("file", file);
+
+    fetch("/api/menu/bulk", { method: "POST", body: formData })
+        .then(res => res.json())
+        .then(data => {
+            input.value = "";
+            if (data.error) {
+                alert(data.error);
+                return;
+            }
+
+            let msg = `${data.inserted} added, ${data.updated} updated`;
+            if (data.errors.length) {
+                msg += `\n\n${data.errors.length} row(s) skipped:\n` +
+                    data.errors.slice(0, 20)
+                        .map(e => `Row ${e.row}: ${e.error}`)
+                        .join("\n");
+            }
+            alert(msg);
+            loadMenu();
+        });
+}
+
 /* ================= EDIT MODAL ================= */
 function openEditModal(id, name, price, category) {
     document.getElementById("edit-id").value = id;
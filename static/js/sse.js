@@ -1,5 +1,5 @@
 const evt = new EventSource("/events");
-evt.onmessage = e => {
+evt.addEventListener("order", e => {
     console.log("LIVE UPDATE:", JSON.parse(e.data));
     location.reload();
-};
+});
@@ -0,0 +1,165 @@
+# Per-restaurant, per-day counters kept in daily_stats, plus all-time
+# per-restaurant totals in restaurant_totals. Every helper here runs inside
+# the caller's write transaction, so the rollups always commit (or roll
+# back) together with the order change they describe.
+
+ROLLUP_QUERY = """
+    SELECT restaurant_id,
+           substr(created_at, 1, 10) AS day,
+           COUNT(*) AS order_count,
+           SUM(status <> 'Served') AS pending_count,
+           IFNULL(SUM(CASE WHEN status='Served' THEN total END), 0) AS served_revenue,
+           IFNULL(SUM(total), 0) AS gross_revenue
+    FROM orders
+    GROUP BY restaurant_id, day
+"""
+
+
+# ---------------- INCREMENTAL UPDATES ----------------
+def bump(db, order_id, orders=0, pending=0, served=0.0, gross=0.0):
+    # The day bucket comes from the order itself, so late status changes
+    # land on the day the order was placed.
+    db.execute("""
+        INSERT INTO daily_stats
+        (restaurant_id, day, order_count, pending_count, served_revenue, gross_revenue)
+        SELECT restaurant_id, substr(created_at, 1, 10), ?, ?, ?, ?
+        FROM orders WHERE id=?
+        ON CONFLICT(restaurant_id, day) DO UPDATE SET
+            order_count = order_count + excluded.order_count,
+            pending_count = pending_count + excluded.pending_count,
+            served_revenue = served_revenue + excluded.served_revenue,
+            gross_revenue = gross_revenue + excluded.gross_revenue
+    """, (orders, pending, served, gross, order_id))
+
+    if orders or gross:
+        db.execute("""
+            INSERT INTO restaurant_totals (restaurant_id, order_count, gross_revenue)
+            SELECT restaurant_id, ?, ? FROM orders WHERE id=?
+            ON CONFLICT(restaurant_id) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                gross_revenue = gross_revenue + excluded.gross_revenue
+        """, (orders, gross, order_id))
+
+
+def order_placed(db, order_id, total):
+    bump(db, order_id, orders=1, pending=1, gross=total)
+
+
+def items_added(db, order_id, amount):
+    served = db.execute(
+        "SELECT status='Served' FROM orders WHERE id=?", (order_id,)
+    ).fetchone()[0]
+    bump(db, order_id, served=amount if served else 0.0, gross=amount)
+
+
+def set_status(db, order_id, restaurant_id, status):
+    # Guarded UPDATEs tell us whether the order crossed the Served line
+    # without a separate read that could race with another writer.
+    if status == "Served":
+        crossed = db.execute("""
+            UPDATE orders SET status='Served'
+            WHERE id=? AND restaurant_id=? AND status<>'Served'
+        """, (order_id, restaurant_id)).rowcount
+        sign = 1
+    else:
+        crossed = db.execute("""
+            UPDATE orders SET status=?
+            WHERE id=? AND restaurant_id=? AND status='Served'
+        """, (status, order_id, restaurant_id)).rowcount
+        sign = -1
+        if not crossed:
+            db.execute("""
+                UPDATE orders SET status=?
+                WHERE id=? AND restaurant_id=?
+            """, (status, order_id, restaurant_id))
+
+    if crossed:
+        total = db.execute(
+            "SELECT total FROM orders WHERE id=?", (order_id,)
+        ).fetchone()[0]
+        bump(db, order_id, pending=-sign, served=sign * total)
+
+
+def restaurant_created(db, restaurant_id):
+    db.execute(
+        "INSERT OR IGNORE INTO restaurant_totals (restaurant_id) VALUES (?)",
+        (restaurant_id,)
+    )
+
+
+# ---------------- READS ----------------
+def served_revenue(db, restaurant_id, first_day, last_day=None):
+    return db.execute("""
+        SELECT IFNULL(SUM(served_revenue), 0)
+        FROM daily_stats
+        WHERE restaurant_id=? AND day BETWEEN ? AND ?
+    """, (restaurant_id, first_day, last_day or first_day)).fetchone()[0]
+
+
+# ---------------- REBUILD / VERIFY ----------------
+def rebuild(db):
+    db.execute("DELETE FROM daily_stats")
+    db.execute(f"""
+        INSERT INTO daily_stats
+        (restaurant_id, day, order_count, pending_count, served_revenue, gross_revenue)
+        {ROLLUP_QUERY}
+    """)
+    db.execute("DELETE FROM restaurant_totals")
+    fill_totals(db)
+
+
+def fill_totals(db):
+    # Adds a restaurant_totals row for every restaurant that lacks one.
+    db.execute("""
+        INSERT INTO restaurant_totals (restaurant_id, order_count, gross_revenue)
+        SELECT r.id,
+               IFNULL(SUM(d.order_count), 0),
+               IFNULL(SUM(d.gross_revenue), 0)
+        FROM restaurants r
+        LEFT JOIN daily_stats d ON d.restaurant_id = r.id
+        WHERE r.id NOT IN (SELECT restaurant_id FROM restaurant_totals)
+        GROUP BY r.id
+    """)
+
+
+def check(db):
+    # Rows where the stored rollup disagrees with the raw orders.
+    expected = {
+        (r[0], r[1]): tuple(r[2:])
+        for r in db.execute(ROLLUP_QUERY).fetchall()
+    }
+    stored = {
+        (r[0], r[1]): tuple(r[2:])
+        for r in db.execute("""
+            SELECT restaurant_id, day, order_count, pending_count,
+                   served_revenue, gross_revenue
+            FROM daily_stats
+        """).fetchall()
+    }
+
+    def same(a, b):
+        a = a or (0, 0, 0.0, 0.0)
+        b = b or (0, 0, 0.0, 0.0)
+        return a[:2] == b[:2] and all(round(x - y, 2) == 0 for x, y in zip(a[2:], b[2:]))
+
+    mismatches = [
+        (key, expected.get(key), stored.get(key))
+        for key in sorted(set(expected) | set(stored))
+        if not same(expected.get(key), stored.get(key))
+    ]
+
+    totals = db.execute("""
+        SELECT r.id,
+               (SELECT COUNT(*) FROM orders o WHERE o.restaurant_id = r.id),
+               (SELECT IFNULL(SUM(total), 0) FROM orders o WHERE o.restaurant_id = r.id),
+               t.order_count, t.gross_revenue
+        FROM restaurants r
+        LEFT JOIN restaurant_totals t ON t.restaurant_id = r.id
+    """).fetchall()
+    for rid, count, gross, stored_count, stored_gross in totals:
+        if stored_count != count or round((stored_gross or 0) - gross, 2) != 0:
+            mismatches.append(
+                ((rid, "all-time"), (count, gross), (stored_count, stored_gross))
+            )
+
+    return mismatches
@@ -0,0 +1,59 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Shared process pool for CPU-bound rendering (QR codes, PDF bills) so a
+# big batch does not stall every other request on the same web worker.
+POOL_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        # spawn keeps the children free of gevent/gunicorn state
+        _pool = ProcessPoolExecutor(
+            max_workers=POOL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def pool_map(fn, items, threshold):
+    # fn over items, in the pool once there are enough to pay for it.
+    # fn must be a module-level function so the children can import it.
+    items = list(items)
+    if len(items) < threshold or POOL_WORKERS < 2:
+        return [fn(item) for item in items]
+
+    chunk = max(1, len(items) // (POOL_WORKERS * 4))
+    return list(get_pool().map(fn, items, chunksize=chunk))
+
+
+def ensure_thread(thread, target, name):
+    # Returns `thread` if it is running, else starts a new daemon thread.
+    # Background threads are started on first use rather than at import so
+    # that forking gunicorn workers never inherit them. They live as long
+    # as the process, so any SQLite connection they need is their own from
+    # db.connect, not one borrowed from the request pool. Callers hold
+    # their own lock around this.
+    if thread is None or not thread.is_alive():
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+    return thread
+
+
+def run_worker(process, dbs, interval=1.0, once=False):
+    # Queue loop shared by the CLI workers: process(db) handles one batch
+    # and returns how many items it handled. dbs() returns the connections
+    # to drain and is asked again on every pass, so shards created
+    # meanwhile are picked up.
+    while True:
+        handled = sum(process(db) for db in dbs())
+        if once and not handled:
+            return
+        if not handled:
+            time.sleep(interval)